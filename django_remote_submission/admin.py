@@ -1,6 +1,7 @@
 """Provide an admin interface for managing jobs."""
 
 # -*- coding: utf-8 -*-
+from django.conf import settings
 from django.contrib import admin
 from django import forms
 from django.utils.translation import ungettext_lazy as _
@@ -8,7 +9,13 @@ from django.shortcuts import render
 from django.http.response import HttpResponseRedirect
 
 from .models import Server, Job, Log, Interpreter, Result
-from .tasks import submit_job_to_server
+from .tasks import submit_jobs_to_server
+
+DEFAULT_MAX_PARALLEL = 9
+"""The most jobs the admin action runs at the same time on each server,
+unless the ``REMOTE_SUBMISSION_MAX_PARALLEL`` setting is given. OpenSSH
+allows 10 sessions per connection by default, one of which is used for
+SFTP."""
 
 @admin.register(Interpreter)
 class InterpreterAdmin(admin.ModelAdmin):
@@ -92,14 +99,18 @@ class JobAdmin(admin.ModelAdmin):
                 password = form.cleaned_data['password']
                 username = form.cleaned_data['username']
 
-                count = 0
-                for job in queryset:
-                    submit_job_to_server.delay(
-                        job_pk=job.pk,
-                        password=password,
-                        username=username,
-                    )
-                    count += 1
+                # The jobs are submitted together, so each server is only
+                # connected to once
+                job_pks = list(queryset.values_list('pk', flat=True))
+                submit_jobs_to_server.delay(
+                    job_pks=job_pks,
+                    password=password,
+                    username=username or None,
+                    max_parallel=getattr(settings,
+                                         'REMOTE_SUBMISSION_MAX_PARALLEL',
+                                         DEFAULT_MAX_PARALLEL),
+                )
+                count = len(job_pks)
 
                 message = _(
                     'Successfully submitted %(count)s job',
@@ -135,6 +146,10 @@ class JobAdmin(admin.ModelAdmin):
 
 @admin.register(Log)
 class LogAdmin(admin.ModelAdmin):
-    """Manage logs with the default admin interface."""
+    """Manage logs with the default admin interface.
 
-    pass
+    The content of compressed logs is shown decompressed, read-only.
+
+    """
+
+    readonly_fields = ('text',)
@@ -0,0 +1,180 @@
+"""Submit jobs from an asyncio event loop.
+
+:func:`submit_job_to_server_async` is the coroutine counterpart of
+:func:`tasks.submit_job_to_server`. It runs the job through the wrappers of
+:mod:`.wrapper.aio`, so while the job runs it only holds on to a connection,
+not to a thread, and one event loop can supervise many jobs at once::
+
+    import asyncio
+    from asgiref.sync import async_to_sync
+
+    async def submit_all(job_pks, password):
+        return await asyncio.gather(*[
+            submit_job_to_server_async(job_pk, password)
+            for job_pk in job_pks
+        ])
+
+    async_to_sync(submit_all)(job_pks, password)
+
+The database is only accessed through :func:`asgiref.sync.sync_to_async`,
+so it is never used from the event loop itself.
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import tempfile
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .harvest import TransferBudget, TransferFile, is_matching
+from .models import Job, Result
+from .tasks import LogContainer, LogPolicy, _job_command
+from .wrapper.aio import AsyncLocalWrapper, AsyncRemoteWrapper
+
+logger = logging.getLogger(__name__)
+
+
+async def submit_job_to_server_async(job_pk, password=None,
+                                     public_key_filename=None,
+                                     username=None, timeout=None,
+                                     log_policy=LogPolicy.LOG_LIVE,
+                                     store_results=None, remote=True,
+                                     buffer_size=None, line_buffered=True,
+                                     chunk_size=None, recursive=False,
+                                     log_flush_interval=0.5,
+                                     log_flush_size=65536):
+    """Submit a job to the remote server, as a coroutine.
+
+    The parameters are the same as those of
+    :func:`tasks.submit_job_to_server`; the options to limit, deduplicate
+    or filter the results on the server are not supported here.
+
+    :param int job_pk: the primary key of the :class:`models.Job` to submit
+    :param str password: the password of the user submitting the job
+    :param public_key_filename: the path where it is.
+    :param str username: the username of the user submitting, if it is
+        different from the owner of the job
+    :param datetime.timedelta timeout: the timeout for running the job
+    :param LogPolicy log_policy: the policy to use for logging
+    :param list(str) store_results: the patterns to use for the results to
+        store
+    :param bool remote: Either runs this task locally on the host or in a
+        remote server.
+    :param int buffer_size: the number of bytes of output to read at a time,
+        defaults to the :attr:`models.Server.buffer_size` of the job's server
+    :param bool line_buffered: only log whole lines of output
+    :param int chunk_size: the number of bytes of a result file to transfer
+        at a time
+    :param bool recursive: also store the results in subdirectories of the
+        remote directory, keeping their relative path
+    :param float log_flush_interval: with :const:`LogPolicy.LOG_BATCHED`, the
+        longest time (in seconds) to hold back output before logging it
+    :param int log_flush_size: with :const:`LogPolicy.LOG_BATCHED`, the most
+        characters of output to hold back before logging it
+    :returns: a dict mapping the filenames of the stored results to their
+        primary keys
+
+    """
+    job = await sync_to_async(_get_job)(job_pk)
+
+    if username is None:
+        username = job.owner.username
+
+    wrapper_cls = AsyncRemoteWrapper if remote else AsyncLocalWrapper
+    wrapper = wrapper_cls(
+        hostname=job.server.hostname,
+        username=username,
+        port=job.server.port,
+    )
+
+    logs = LogContainer(
+        job=job,
+        log_policy=log_policy,
+        flush_interval=log_flush_interval,
+        flush_size=log_flush_size,
+    )
+
+    command = _job_command(job, logs, timeout)
+    for handler in ('stdout_handler', 'stderr_handler', 'tick_handler'):
+        command[handler] = sync_to_async(command[handler])
+
+    await wrapper.connect(password, public_key_filename)
+    try:
+        await wrapper.chdir(job.remote_directory)
+
+        f = await wrapper.open(job.remote_filename, 'wt')
+        try:
+            await f.write(job.program)
+        finally:
+            await f.close()
+
+        script_mtime = (await wrapper.stat(job.remote_filename)).st_mtime
+
+        job.status = Job.STATUS.submitted
+        await sync_to_async(job.save)()
+
+        job_status = await wrapper.exec_command(
+            buffer_size=buffer_size or job.server.buffer_size,
+            line_buffered=line_buffered,
+            tick_interval=logs.tick_interval,
+            **command
+        )
+
+        await sync_to_async(logs.close)()
+
+        job.status = Job.STATUS.success if job_status else Job.STATUS.failure
+        await sync_to_async(job.save)()
+
+        results = await _harvest(wrapper, job, script_mtime, store_results,
+                                 chunk_size, recursive)
+    finally:
+        await wrapper.close()
+
+    return {r.remote_filename: r.pk for r in results}
+
+
+def _get_job(job_pk):
+    return Job.objects.select_related(
+        'owner', 'server', 'interpreter').get(pk=job_pk)
+
+
+async def _harvest(wrapper, job, script_mtime, store_results, chunk_size,
+                   recursive):
+    """Store the files modified by a job, one after the other.
+
+    Each file is downloaded to a temporary file first, which is then stored
+    from a thread.
+
+    """
+    results = []
+    for attr in await wrapper.listdir_attr(recursive):
+        if (attr.filename == job.remote_filename or
+                attr.st_mtime < script_mtime or
+                not is_matching(attr.filename, store_results)):
+            continue
+
+        with tempfile.SpooledTemporaryFile(1048576) as f:
+            size = await wrapper.download(attr.filename, f, chunk_size)
+            f.seek(0)
+            results.append(await sync_to_async(_store_result)(
+                job, attr.filename, f, size, chunk_size))
+
+    await sync_to_async(_save_results)(results)
+    return results
+
+
+def _store_result(job, filename, f, size, chunk_size):
+    result = Result(remote_filename=filename, job=job)
+    content = TransferFile(f, size, TransferBudget(), chunk_size)
+    result.local_file.save(filename, content, save=False)
+    result.size = content.transferred
+    result.checksum = content.digest.hexdigest()
+    return result
+
+
+def _save_results(results):
+    with transaction.atomic():
+        for result in results:
+            result.save()
@@ -0,0 +1,169 @@
+"""Send the updates for the browser to the channel layer in batches.
+
+Sending a message to a channel layer group is a round trip to the layer
+(e.g. Redis), and a running job can produce many updates a second. The
+:data:`broadcaster` collects the messages for each group and sends them as a
+single message holding a list, at most every
+:attr:`Broadcaster.flush_interval` seconds::
+
+    broadcaster.send('job-log-1', {'log_id': 1, 'content': 'hello'})
+    broadcaster.send('job-user-john', {'job_id': 1, 'status': 'success'},
+                     key=1)
+
+Messages sent during a transaction are only queued once it is committed,
+and dropped if it is rolled back, so listeners never hear about rows they
+cannot read yet.
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import functools
+import itertools
+import logging
+import threading
+import time
+
+import channels.layers
+from asgiref.sync import async_to_sync
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster(object):
+    """Collect the messages for channel layer groups, and send them batched.
+
+    The first message after a quiet period is sent right away. The ones
+    that follow it within :attr:`flush_interval` are held back, then sent
+    together, either when the next message comes in, when :meth:`tick` or
+    :meth:`flush` is called, or by a timer at the latest.
+
+    A message sent with a ``key`` replaces the unsent message of its group
+    with the same key (e.g. the earlier status of the same job), and moves to
+    the end of the batch, so the batch stays in the order of the latest
+    updates.
+
+    """
+
+    def __init__(self, flush_interval=0.1):
+        """Instantiate a broadcaster.
+
+        :param float flush_interval: the shortest time (in seconds) between
+            two batches
+
+        """
+        self.flush_interval = flush_interval
+        """The shortest time (in seconds) between two batches."""
+
+        self._groups = collections.OrderedDict()
+        """The unsent messages of each group, by key."""
+
+        self._last_flush = 0
+        """When the last batch was sent."""
+
+        self._timer = None
+        """The timer flushing the held back messages, if any."""
+
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+
+        self._send_lock = threading.Lock()
+        """Held while sending a batch, so batches never overtake each
+        other."""
+
+    def send(self, group, message, key=None):
+        """Queue a message for a group.
+
+        :param str group: the name of the channel layer group
+        :param message: the message, which must be serializable to JSON
+        :param key: the key of the message, for it to replace the unsent
+            message of the group with the same key
+
+        """
+        self.send_many([(group, message, key)])
+
+    def send_many(self, messages):
+        """Queue several messages at once, so they are sent together.
+
+        :param messages: the ``(group, message, key)`` of each message, as
+            accepted by :meth:`send`
+
+        """
+        messages = list(messages)
+        if not messages:
+            return
+
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(functools.partial(self._queue, messages))
+        else:
+            self._queue(messages)
+
+    def tick(self):
+        """Send the queued messages, unless a batch was just sent."""
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+        else:
+            self._start_timer()
+
+    def flush(self):
+        """Send the queued messages now, with one message for each group.
+
+        This should also be called before the process exits, as the timer
+        does not keep it running.
+
+        """
+        with self._send_lock:
+            with self._lock:
+                groups, self._groups = self._groups, collections.OrderedDict()
+                self._last_flush = time.time()
+
+            if not groups:
+                return
+
+            channel_layer = channels.layers.get_channel_layer()
+            for group, messages in groups.items():
+                async_to_sync(channel_layer.group_send)(
+                    group,
+                    {
+                        'type': 'send_message',
+                        'text': list(messages.values()),
+                    }
+                )
+
+    def _queue(self, messages):
+        with self._lock:
+            for group, message, key in messages:
+                queued = self._groups.setdefault(group,
+                                                 collections.OrderedDict())
+                if key is None:
+                    key = ('', next(self._keys))
+
+                queued.pop(key, None)
+                queued[key] = message
+
+        self.tick()
+
+    def _start_timer(self):
+        with self._lock:
+            if self._timer is not None or not self._groups:
+                return
+
+            delay = max(0, self._last_flush + self.flush_interval -
+                        time.time())
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not send the queued messages')
+
+
+broadcaster = Broadcaster()
+"""The broadcaster used for the updates of jobs and logs."""
@@ -1,9 +1,14 @@
 # """Manage websocket connections."""
 
 import json
+from six.moves.urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.db.models.functions import Length
 
-from .models import Job
+from .models import Log
+from .signals import log_message, recent_jobs
 
 
 class JobUserConsumer(AsyncWebsocketConsumer):
@@ -32,25 +37,12 @@ class JobUserConsumer(AsyncWebsocketConsumer):
         )
 
     async def send_last_jobs(self, user):
+        '''
+        Sends the last modified jobs to this browser only, in one message
+        '''
+        messages = await database_sync_to_async(recent_jobs)(user.pk)
 
-        last_jobs = user.jobs.order_by('-modified')[:10]
-
-        for job in last_jobs:
-
-            message = {
-                'job_id': job.id,
-                'title': job.title,
-                'status': job.status,
-                'modified': job.modified.isoformat(),
-            }
-
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'send_message',
-                    'text': message
-                }
-            )
+        await self.send(text_data=json.dumps(messages))
 
     async def send_message(self, event):
         message = event['text']
@@ -63,13 +55,22 @@ class JobUserConsumer(AsyncWebsocketConsumer):
 
 class JobLogConsumer(AsyncWebsocketConsumer):
 
+    log_page_size = 1000
+    """The most logs to send to the browser in a single message."""
+
+    log_page_content = 1048576
+    """The most characters of log content to send to the browser in a single
+    message, unless a single log holds more."""
+
     async def connect(self):
         '''
         Creates group, add to the valid channels
-        Connects and sends to the browser the log
+        Connects and sends to the browser the log, after the last log it
+        saw if it is reconnecting with ``?seq=<seq>``
         '''
         job_pk = self.scope['url_route']['kwargs']['job_pk']
         self.group_name = 'job-log-{}'.format(job_pk)
+        self.last_seq = self.get_resume_seq()
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -87,30 +88,66 @@ class JobLogConsumer(AsyncWebsocketConsumer):
         )
 
     async def send_log(self, job_pk):
+        '''
+        Sends the logs of the job to this browser only, a page at a time,
+        without blocking the event loop on the database
+        '''
+        while True:
+            messages = await self.get_log_page(job_pk, self.last_seq)
+            if not messages:
+                break
+
+            await self.send(text_data=json.dumps(messages))
+            self.last_seq = messages[-1]['seq']
 
-        job = Job.objects.get(pk=job_pk)
-        logs = job.logs.order_by('time')
-
-        for log in logs:
-            message = {
-                'log_id': log.id,
-                'time': log.time.isoformat(),
-                'content': log.content,
-                'stream': log.stream,
-            }
-
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'send_message',
-                    'text': message
-                }
-            )
+    def get_resume_seq(self):
+        '''
+        Returns the :attr:`models.Log.seq` of the last log the browser saw,
+        from the query string, or 0 to send all the logs
+        '''
+        query = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        try:
+            return max(0, int(query['seq'][-1]))
+        except (KeyError, ValueError):
+            return 0
+
+    @database_sync_to_async
+    def get_log_page(self, job_pk, seq):
+        '''
+        Returns the messages for the page of logs of the job following the
+        log numbered ``seq``
+
+        The sizes of the logs are read first, so the page is cut before its
+        content adds up to more than :attr:`log_page_content`.
+        '''
+        logs = Log.objects.filter(job_id=job_pk, seq__gt=seq).order_by('seq')
+
+        last_seq = None
+        total = 0
+        sizes = logs.annotate(size=Length('content')).values_list(
+            'seq', 'size')
+        for log_seq, size in sizes[:self.log_page_size]:
+            if last_seq is not None and total + size > self.log_page_content:
+                break
+
+            last_seq = log_seq
+            total += size
+
+        if last_seq is None:
+            return []
+
+        return [log_message(log) for log in logs.filter(seq__lte=last_seq)]
 
     async def send_message(self, event):
-        message = event['text']
+        # The logs saved while the replay was running are broadcast too.
+        # Logs without a number (e.g. from a plain ``bulk_create``) are
+        # never replayed, so they are always sent.
+        messages = [m for m in event['text']
+                    if m['seq'] is None or m['seq'] > self.last_seq]
+        if not messages:
+            return
 
         # Send message to WebSocket
         await self.send(text_data=json.dumps(
-            message
+            messages
         ))
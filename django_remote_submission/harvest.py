@@ -0,0 +1,380 @@
+"""Store the files produced by a job as :class:`models.Result` instances.
+
+After a job has run, :class:`ResultHarvester` looks for the files it created
+or modified in its remote directory and streams them into Django's storage.
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import fnmatch
+import hashlib
+import logging
+import threading
+
+from django.core.files import File
+from django.db import transaction
+
+from .models import Result
+
+logger = logging.getLogger(__name__)
+
+
+def is_matching(filename, patterns=None):
+    """Check if a filename matches the list of positive and negative patterns.
+
+    Positive patterns are strings like ``"1.txt"``, ``"[23].txt"``, or
+    ``"*.txt"``.
+
+    Negative patterns are strings like ``"!1.txt"``, ``"![23].txt"``, or
+    ``"!*.txt"``.
+
+    Each pattern is checked in turn, so the list of patterns ``["!*.txt",
+    "1.txt"]`` will still match ``"1.txt"``.
+
+    >>> from django_remote_submission.harvest import is_matching
+    >>> is_matching("1.txt", patterns=["1.txt"])
+    True
+    >>> is_matching("1.txt", patterns=["[12].txt"])
+    True
+    >>> is_matching("1.txt", patterns=["*.txt"])
+    True
+    >>> is_matching("1.txt", patterns=["1.txt", "!*.txt"])
+    False
+    >>> is_matching("1.txt", patterns=["!*.txt", "[12].txt"])
+    True
+
+    """
+    if patterns is None:
+        patterns = ['*']
+
+    is_matching = False
+
+    for pattern in patterns:
+        if not pattern.startswith('!'):
+            if fnmatch.fnmatch(filename, pattern):
+                is_matching = True
+        else:
+            if fnmatch.fnmatch(filename, pattern[1:]):
+                is_matching = False
+
+    return is_matching
+
+
+class TransferAborted(Exception):
+    """Raised while storing a result that went over a size limit."""
+
+
+class JobTransferAborted(TransferAborted):
+    """Raised once a job's results went over the limit for the whole job."""
+
+
+class TransferBudget(object):
+    """Keep track of the bytes transferred for a job's results.
+
+    The budget is shared by all the workers downloading the job's results,
+    so it can be used from several threads at once.
+
+    """
+
+    def __init__(self, max_file_size=None, max_total_size=None):
+        """Instantiate a transfer budget.
+
+        :param int max_file_size: the most bytes to transfer for one file
+        :param int max_total_size: the most bytes to transfer for the job
+
+        """
+        self.max_file_size = max_file_size
+        """The most bytes to transfer for one file, if limited."""
+
+        self.max_total_size = max_total_size
+        """The most bytes to transfer for the whole job, if limited."""
+
+        self.total = 0
+        """The number of bytes transferred so far."""
+
+        self._lock = threading.Lock()
+
+    def allows(self, size, planned):
+        """Check whether a file of the given size fits in the budget.
+
+        :param int size: the size of the file
+        :param int planned: the bytes already planned for other files
+
+        """
+        if self.max_file_size is not None and size > self.max_file_size:
+            return False
+
+        if (self.max_total_size is not None and
+                planned + size > self.max_total_size):
+            return False
+
+        return True
+
+    def consume(self, transferred, size):
+        """Account for a chunk that was just read.
+
+        :param int transferred: the bytes read for the file so far,
+            including this chunk
+        :param int size: the size of the chunk
+
+        """
+        if self.max_file_size is not None and transferred > self.max_file_size:
+            raise TransferAborted('more than {} bytes'.format(
+                self.max_file_size))
+
+        with self._lock:
+            self.total += size
+            if (self.max_total_size is not None and
+                    self.total > self.max_total_size):
+                raise JobTransferAborted(
+                    'more than {} bytes for the job'.format(
+                        self.max_total_size))
+
+
+class TransferFile(File):
+    """A file read in bounded chunks, checked against a budget and hashed."""
+
+    def __init__(self, file, size, budget, chunk_size=None):
+        """Wrap a file that is being transferred.
+
+        :param file: the file to read from
+        :param int size: the expected size of the file
+        :param TransferBudget budget: the budget to charge the reads to
+        :param int chunk_size: the number of bytes to read at a time
+
+        """
+        super(TransferFile, self).__init__(file)
+        self.size = size
+        self.budget = budget
+        self.chunk_size = chunk_size or File.DEFAULT_CHUNK_SIZE
+
+        self.transferred = 0
+        """The number of bytes read so far."""
+
+        self.digest = hashlib.sha256()
+        """The SHA-256 digest of the bytes read so far."""
+
+    def read(self, size=-1):  # noqa: D102
+        data = self.file.read(size)
+        self.transferred += len(data)
+        self.budget.consume(self.transferred, len(data))
+        self.digest.update(data)
+        return data
+
+    def chunks(self, chunk_size=None):  # noqa: D102
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+
+            yield data
+
+
+class ResultHarvester(object):
+    """Download the files a job produced and save them as results.
+
+    The files are downloaded by several workers at once (see
+    :meth:`RemoteWrapper.read_files`), each one streaming to Django's
+    storage as the data arrives, a chunk at a time. Files over
+    ``max_file_size`` are skipped, and once the job's results reach
+    ``max_total_size`` the remaining files are skipped too.
+
+    With ``skip_unchanged``, the checksums of the files are computed on the
+    server first (see :meth:`RemoteWrapper.checksums`). A file with the same
+    name and checksum as an earlier result from the same remote directory of
+    the same server is not transferred again: the new result shares the
+    earlier result's stored file instead.
+
+    With ``recursive``, the files in the subdirectories of the job's remote
+    directory are harvested too, keeping their relative path (such as
+    ``"output/1.txt"``) as the result's ``remote_filename``. Patterns are
+    matched against that whole path, and ``*`` also matches ``/``.
+
+    With ``filter_remotely``, the files are found with
+    :meth:`RemoteWrapper.find_attr` instead of
+    :meth:`RemoteWrapper.listdir_attr`, so the server only lists the files
+    modified by the job that match ``store_results``. This is much faster in
+    directories holding many other files.
+
+    """
+
+    def __init__(self, wrapper, job, workers=4, chunk_size=None,
+                 max_file_size=None, max_total_size=None,
+                 skip_unchanged=False, recursive=False,
+                 filter_remotely=False):
+        """Instantiate a result harvester.
+
+        :param RemoteWrapper wrapper: a connected wrapper
+        :param models.Job job: the job that produced the files
+        :param int workers: the most files to download at the same time
+        :param int chunk_size: the number of bytes to transfer at a time
+        :param int max_file_size: the most bytes to transfer for one file
+        :param int max_total_size: the most bytes to transfer for the job
+        :param bool skip_unchanged: share the stored files of earlier
+            results with the same checksum instead of transferring them
+        :param bool recursive: harvest the files in subdirectories too
+        :param bool filter_remotely: only list the files that may be results
+            on the server
+
+        """
+        self.wrapper = wrapper
+        self.job = job
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.skip_unchanged = skip_unchanged
+        self.recursive = recursive
+        self.filter_remotely = filter_remotely
+
+    def list_files(self, newer_than, store_results):
+        """List the files of the job's remote directory that may be results.
+
+        The wrapper must already be in the job's remote directory.
+
+        :param float newer_than: the oldest modification time of a result
+        :param list(str) store_results: the patterns to use for the results
+            to store
+        :returns: the attributes of the files
+
+        """
+        if self.filter_remotely:
+            return self.wrapper.find_attr(newer_than, store_results,
+                                          self.recursive)
+
+        return self.wrapper.listdir_attr(self.recursive)
+
+    def harvest(self, script_mtime, store_results, listing=None):
+        """Store the matching files from the job's remote directory.
+
+        The wrapper must already be in the job's remote directory.
+
+        :param float script_mtime: the modification time of the job's program
+            when it was uploaded; older files are not results of this job
+        :param list(str) store_results: the patterns to use for the results
+            to store
+        :param list listing: the files of the remote directory, as returned
+            by :meth:`list_files` (e.g. once for several jobs sharing the
+            directory), instead of listing them again
+        :returns: the saved :class:`models.Result` instances
+
+        """
+        budget = TransferBudget(self.max_file_size, self.max_total_size)
+        field = Result._meta.get_field('local_file')
+        storage = field.storage
+
+        if listing is None:
+            listing = self.list_files(script_mtime, store_results)
+
+        candidates = [
+            attr for attr in listing
+            if attr.filename != self.job.remote_filename and
+            attr.st_mtime >= script_mtime and
+            is_matching(attr.filename, store_results)
+        ]
+
+        unchanged = {}
+        if self.skip_unchanged:
+            unchanged = self._find_unchanged(candidates)
+
+        results = {}
+
+        file_attrs = []
+        planned = 0
+        for attr in candidates:
+            result = Result(remote_filename=attr.filename, job=self.job)
+            results[attr.filename] = result
+
+            previous = unchanged.get(attr.filename)
+            if (previous is not None and
+                    storage.exists(previous.local_file.name)):
+                logger.debug('Sharing the stored %s for job %s',
+                             attr.filename, self.job.pk)
+                result.local_file = previous.local_file.name
+                result.size = previous.size
+                result.checksum = previous.checksum
+                continue
+
+            if not budget.allows(attr.st_size, planned):
+                logger.warning('Not storing %s (%d bytes) for job %s: '
+                               'over the size limit',
+                               attr.filename, attr.st_size, self.job.pk)
+                del results[attr.filename]
+                continue
+
+            planned += attr.st_size
+            file_attrs.append(attr)
+
+        stored = set(results) - {attr.filename for attr in file_attrs}
+
+        def store(attr, f):
+            result = results[attr.filename]
+            content = TransferFile(f, attr.st_size, budget, self.chunk_size)
+            name = storage.get_available_name(
+                field.generate_filename(result, attr.filename),
+                max_length=field.max_length,
+            )
+
+            try:
+                name = storage.save(name, content,
+                                    max_length=field.max_length)
+            except TransferAborted as e:
+                logger.warning('Stopped storing %s for job %s: %s',
+                               attr.filename, self.job.pk, e)
+                if storage.exists(name):
+                    storage.delete(name)
+
+                if isinstance(e, JobTransferAborted):
+                    raise
+                return
+
+            result.local_file = name
+            result.size = content.transferred
+            result.checksum = content.digest.hexdigest()
+            stored.add(attr.filename)
+
+        try:
+            self.wrapper.read_files(file_attrs, store, workers=self.workers)
+        except JobTransferAborted:
+            pass
+
+        saved = [
+            results[attr.filename]
+            for attr in candidates
+            if attr.filename in stored
+        ]
+
+        with transaction.atomic():
+            for result in saved:
+                result.save()
+
+        return saved
+
+    def _find_unchanged(self, file_attrs):
+        """Find the earlier results with the same name and checksum as each
+        of the files, from the same remote directory of the same server.
+
+        :param list file_attrs: the attributes of the files
+        :returns: a dict mapping filenames to the latest matching result
+
+        """
+        checksums = self.wrapper.checksums(
+            [attr.filename for attr in file_attrs])
+        if not checksums:
+            return {}
+
+        previous = {}
+        matches = (
+            Result.objects
+            .filter(checksum__in=set(checksums.values()),
+                    remote_filename__in=list(checksums),
+                    job__server_id=self.job.server_id,
+                    job__remote_directory=self.job.remote_directory)
+            .exclude(local_file='')
+            .order_by('pk')
+        )
+        for result in matches:
+            if checksums.get(result.remote_filename) == result.checksum:
+                previous[result.remote_filename] = result
+
+        return previous
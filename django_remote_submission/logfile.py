@@ -0,0 +1,159 @@
+"""Keep the output of a job in one append-only file per stream.
+
+Instead of holding the output itself, the :class:`models.Log` instances of a
+job using a :class:`JobLogFile` only index the part of the file they were
+appended as, with :attr:`models.Log.offset` and :attr:`models.Log.length`.
+Any range of the output, such as its last 64 KiB, can then be read without
+going through all of the job's logs.
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import errno
+import os
+
+from .models import Log, job_log_path
+
+
+def read_logs(logs):
+    """Read the content of many logs at once.
+
+    The logs indexing a :class:`JobLogFile` are read in one pass over each
+    file, in the order of their offsets, instead of opening the file again
+    for each log. The content of the other logs is read with
+    :attr:`models.Log.text`.
+
+    :param list(models.Log) logs: the logs to read
+    :returns: the content of each log, in the order given
+
+    """
+    texts = [None] * len(logs)
+    indexed = collections.defaultdict(list)
+    for i, log in enumerate(logs):
+        if log.blob and log.offset is not None:
+            indexed[log.blob.name].append((log.offset, log.length, i))
+        else:
+            texts[i] = log.text
+
+    storage = Log._meta.get_field('blob').storage
+    for name, ranges in indexed.items():
+        f = storage.open(name, 'rb')
+        try:
+            for offset, length, i in sorted(ranges):
+                f.seek(offset)
+                texts[i] = f.read(length).decode('utf-8')
+        finally:
+            f.close()
+
+    return texts
+
+
+class JobLogFile(object):
+    """The file holding the output of one of a job's streams.
+
+    The file is kept in the storage of :attr:`models.Log.blob`. Reading works
+    with any storage, but appending needs one that stores files on a local
+    path, such as Django's default ``FileSystemStorage``.
+
+    """
+
+    def __init__(self, job, stream):
+        """Instantiate the log file of a job's stream.
+
+        :param models.Job job: the job the output came from
+        :param str stream: either ``"stdout"`` or ``"stderr"``
+
+        """
+        self.job = job
+        """The job the output came from."""
+
+        self.stream = stream
+        """The stream the output came from."""
+
+        self.storage = Log._meta.get_field('blob').storage
+        """The storage the file is kept in."""
+
+        self.name = job_log_path(self, '{}.log'.format(stream))
+        """The name of the file in the :attr:`storage`."""
+
+    @property
+    def size(self):
+        """The number of bytes of output in the file."""
+        if not self.storage.exists(self.name):
+            return 0
+
+        return self.storage.size(self.name)
+
+    def append(self, chunks):
+        """Append some output to the file.
+
+        :param chunks: the output, as an iterable of strings
+        :returns: the offset and length, in bytes, of the appended output
+        :raises NotImplementedError: if the storage has no local paths
+
+        """
+        path = self.storage.path(self.name)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with open(path, 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            for chunk in chunks:
+                f.write(chunk.encode('utf-8'))
+
+            return offset, f.tell() - offset
+
+    def log(self, time, chunks):
+        """Append some output to the file, and index it with a log.
+
+        :param datetime.datetime time: the time the output was produced
+        :param chunks: the output, as an iterable of strings
+        :returns: the unsaved :class:`models.Log` indexing the output
+
+        """
+        offset, length = self.append(chunks)
+        return Log(
+            time=time,
+            stream=self.stream,
+            job=self.job,
+            blob=self.name,
+            offset=offset,
+            length=length,
+        )
+
+    def read(self, offset=0, length=None):
+        """Read a range of the output.
+
+        :param int offset: the byte to start reading from; negative offsets
+            count from the end of the file
+        :param int length: the most bytes to read, or everything after
+            ``offset`` if ``None``
+        :returns: the bytes read, empty if there is no output yet
+
+        """
+        if not self.storage.exists(self.name):
+            return b''
+
+        f = self.storage.open(self.name, 'rb')
+        try:
+            if offset < 0:
+                offset = max(0, self.storage.size(self.name) + offset)
+
+            f.seek(offset)
+            return f.read(-1 if length is None else length)
+        finally:
+            f.close()
+
+    def tail(self, length=65536):
+        """Read the end of the output.
+
+        :param int length: the most bytes to read
+        :returns: the last ``length`` bytes of the output
+
+        """
+        return self.read(-length)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-16 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_remote_submission', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='buffer_size',
+            field=models.PositiveIntegerField(default=32768, help_text="The number of bytes to read from a job's output at a time", verbose_name='Output Buffer Size'),
+        ),
+    ]
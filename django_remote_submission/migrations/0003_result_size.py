@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-16 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_remote_submission', '0002_server_buffer_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='size',
+            field=models.BigIntegerField(blank=True, help_text='The number of bytes transferred for this result', null=True, verbose_name='Size'),
+        ),
+    ]
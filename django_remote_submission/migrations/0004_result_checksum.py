@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_remote_submission', '0003_result_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='checksum',
+            field=models.CharField(blank=True, db_index=True, help_text='The SHA-256 digest of the result file', max_length=64, verbose_name='Checksum'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:18
+
+from django.db import migrations, models
+import django_remote_submission.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_remote_submission', '0004_result_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='blob',
+            field=models.FileField(blank=True, help_text='The file holding the compressed content of this log message, if it is not stored in the database', max_length=250, upload_to=django_remote_submission.models.job_log_path, verbose_name='Log Blob'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'none'), ('gzip', 'gzip')], default='', help_text='How the content in the blob is compressed, if it is stored there instead of in the database', max_length=8, verbose_name='Compression'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_remote_submission', '0005_log_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='length',
+            field=models.BigIntegerField(blank=True, help_text="The number of bytes of content of this log message in the blob, if it is part of the job's log file", null=True, verbose_name='Length'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='offset',
+            field=models.BigIntegerField(blank=True, help_text="Where the content of this log message starts in the blob, if it is part of the job's log file", null=True, verbose_name='Offset'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:22
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def number_logs(apps, schema_editor):
+    Log = apps.get_model('django_remote_submission', 'Log')
+    logs = Log.objects.using(schema_editor.connection.alias)
+
+    # The logs are numbered in the order of their primary keys, a batch at a
+    # time, with one query to read and one to update each batch.
+    last_seqs = {}
+    last_pk = None
+    while True:
+        batch = logs.order_by('pk').only('pk', 'job')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            break
+
+        for log in batch:
+            log.seq = last_seqs[log.job_id] = last_seqs.get(log.job_id, 0) + 1
+
+        logs.bulk_update(batch, ['seq'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_remote_submission', '0006_log_offset_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='seq',
+            field=models.PositiveIntegerField(blank=True, help_text='The position of this log among the logs of its job, starting from 1', null=True, verbose_name='Sequence Number'),
+        ),
+        migrations.RunPython(number_logs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='log',
+            constraint=models.UniqueConstraint(fields=('job', 'seq'), name='unique_log_seq'),
+        ),
+    ]
@@ -21,12 +21,16 @@
 """
 # -*- coding: utf-8 -*-
 import ast
+import gzip
+import tempfile
 import uuid
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.dispatch import Signal
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files import File
 
 from model_utils import Choices
 from model_utils.fields import StatusField, AutoCreatedField
@@ -142,6 +146,13 @@ class Server(TimeStampedModel):
         default=22,
     )
 
+    buffer_size = models.PositiveIntegerField(
+        _('Output Buffer Size'),
+        help_text=_('The number of bytes to read from a job\'s output at a '
+                    'time'),
+        default=32768,
+    )
+
     interpreters = models.ManyToManyField(
         Interpreter,
         verbose_name=_("List of interpreters available for this Server")
@@ -313,6 +324,133 @@ class Job(TimeStampedModel):
 
 
 
+logs_created = Signal()
+"""Sent by :meth:`LogManager.bulk_ingest` with the ``logs`` it created, as
+``post_save`` is not sent for them."""
+
+
+class LogManager(models.Manager):
+    """Provide the bulk insertion of :class:`Log` instances."""
+
+    number_attempts = 3
+    """The most times to number and insert logs, if other logs of their jobs
+    were given the same numbers in the meantime."""
+
+    def bulk_ingest(self, logs):
+        """Insert many logs at once and notify the listeners a single time.
+
+        The logs are inserted with one ``bulk_create`` in a transaction,
+        then :data:`logs_created` is sent once with all of them. The logs
+        are numbered after the latest logs of their jobs, in order (see
+        :attr:`Log.seq`).
+
+        :param list(Log) logs: the unsaved logs to insert
+        :returns: the inserted logs, with their primary keys
+
+        """
+        logs = list(logs)
+        if not logs:
+            return []
+
+        with transaction.atomic(using=self.db):
+            last_pk = None
+            if not self._returns_pks():
+                last = self.order_by('-pk').values_list('pk', flat=True)[:1]
+                last_pk = next(iter(last), 0)
+
+            logs = self._insert_numbered(logs,
+                                         lambda: self.bulk_create(logs))
+
+            if last_pk is not None:
+                # The database did not hand back the primary keys, but the
+                # rows were just inserted in this order (and only the job's
+                # own container writes logs for it).
+                pks = (self.filter(pk__gt=last_pk,
+                                   job__in={log.job_id for log in logs})
+                       .order_by('pk').values_list('pk', flat=True))
+                for log, pk in zip(logs, pks):
+                    log.pk = pk
+
+        logs_created.send(sender=self.model, logs=logs)
+        return logs
+
+    def _insert_numbered(self, logs, insert):
+        """Number logs, then insert them.
+
+        The numbers of a job's logs are unique, so if other logs were given
+        the same numbers in the meantime (the jobs cannot be locked on every
+        database), the logs are numbered and inserted again.
+
+        :param list(Log) logs: the unsaved logs
+        :param insert: a function inserting the logs
+        :returns: what ``insert`` returns
+
+        """
+        unnumbered = [log for log in logs if log.seq is None]
+        for attempt in range(1, self.number_attempts + 1):
+            try:
+                with transaction.atomic(using=self.db):
+                    self._number(logs)
+                    return insert()
+            except IntegrityError:
+                if attempt == self.number_attempts:
+                    raise
+
+                for log in unnumbered:
+                    log.seq = None
+
+    def _number(self, logs):
+        """Set the :attr:`Log.seq` of the logs which have none.
+
+        This must be called in a transaction: the jobs of the logs are locked
+        until it ends (on the databases supporting it), so no other logs get
+        the same numbers.
+
+        :param list(Log) logs: the unsaved logs
+
+        """
+        job_pks = {log.job_id for log in logs if log.seq is None}
+        if not job_pks:
+            return
+
+        job_model = self.model._meta.get_field('job').related_model
+        list(job_model.objects.using(self.db).select_for_update()
+             .filter(pk__in=job_pks).values_list('pk', flat=True))
+
+        last_seqs = dict(
+            self.filter(job__in=job_pks).order_by()
+            .values_list('job').annotate(models.Max('seq'))
+        )
+
+        for log in logs:
+            if log.seq is None:
+                log.seq = (last_seqs.get(log.job_id) or 0) + 1
+                last_seqs[log.job_id] = log.seq
+
+    def _returns_pks(self):
+        features = transaction.get_connection(self.db).features
+        return getattr(features, 'can_return_rows_from_bulk_insert',
+                       getattr(features, 'can_return_ids_from_bulk_insert',
+                               False))
+
+
+def job_log_path(instance, filename):
+    """Produce the path to locally store the compressed job logs.
+
+    :param Log instance: the :class:`Log` instance to produce the path for
+    :param str filename: the name of the file (e.g. ``"stdout.log.gz"``)
+
+    >>> from django_remote_submission.models import job_log_path
+    >>> from collections import namedtuple
+    >>> job = namedtuple('Job', ['uuid'])('d6c4b0f6')
+    >>> instance = namedtuple('Log', ['job'])(job)
+    >>> job_log_path(instance, 'stdout.log.gz')
+    'logs/d6c4b0f6/stdout.log.gz'
+
+    """
+    return 'logs/{}/{}'.format(instance.job.uuid, filename)
+
+
 class Log(models.Model):
     """Encapsulates a log message printed from a job.
 
@@ -351,6 +489,45 @@ class Log(models.Model):
         help_text=_('The content of this log message'),
     )
 
+    COMPRESSION_CHOICES = (
+        ('', _('none')),
+        ('gzip', _('gzip')),
+    )
+    compression = models.CharField(
+        _('Compression'),
+        max_length=8,
+        choices=COMPRESSION_CHOICES,
+        help_text=_('How the content in the blob is compressed, if it is '
+                    'stored there instead of in the database'),
+        blank=True,
+        default='',
+    )
+
+    blob = models.FileField(
+        _('Log Blob'),
+        help_text=_('The file holding the compressed content of this log '
+                    'message, if it is not stored in the database'),
+        upload_to=job_log_path,
+        max_length=250,
+        blank=True,
+    )
+
+    offset = models.BigIntegerField(
+        _('Offset'),
+        help_text=_('Where the content of this log message starts in the '
+                    'blob, if it is part of the job\'s log file'),
+        null=True,
+        blank=True,
+    )
+
+    length = models.BigIntegerField(
+        _('Length'),
+        help_text=_('The number of bytes of content of this log message in '
+                    'the blob, if it is part of the job\'s log file'),
+        null=True,
+        blank=True,
+    )
+
     STD_STREAM_CHOICES = (
         ('stdout', _('stdout')),
         ('stderr', _('stderr')),
@@ -371,24 +548,113 @@ class Log(models.Model):
         help_text=_('The job this log came from'),
     )
 
+    seq = models.PositiveIntegerField(
+        _('Sequence Number'),
+        help_text=_('The position of this log among the logs of its job, '
+                    'starting from 1'),
+        null=True,
+        blank=True,
+    )
+
+    objects = LogManager()
+
     class Meta:  # noqa: D101
         verbose_name = _('log')
         verbose_name_plural = _('logs')
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'seq'],
+                                    name='unique_log_seq'),
+        ]
 
     def __str__(self):
         """Convert model to string, e.g. ``"2017-01-02 03:04:05 My Job"``."""
         return '{self.time} {self.job}'.format(self=self)
 
+    def save(self, *args, **kwargs):
+        """Save the log, numbering it after the latest log of its job if it
+        is new and has no :attr:`seq` yet.
+
+        Logs inserted in bulk are numbered by :meth:`LogManager.bulk_ingest`
+        instead, so only the logs saved one at a time pay for the numbering
+        here.
+
+        """
+        if not self._state.adding or self.seq is not None:
+            return super(Log, self).save(*args, **kwargs)
+
+        manager = type(self).objects.db_manager(kwargs.get('using'))
+        return manager._insert_numbered(
+            [self], lambda: super(Log, self).save(*args, **kwargs))
+
+    @property
+    def text(self):
+        """The content of this log message, read from :attr:`blob` if it
+        is stored there."""
+        if not self.blob:
+            return self.content
+
+        f = self.blob.open('rb')
+        try:
+            if self.offset is not None:
+                f.seek(self.offset)
+                return f.read(self.length).decode('utf-8')
+
+            if self.compression == 'gzip':
+                f = gzip.GzipFile(fileobj=f, mode='rb')
+
+            return f.read().decode('utf-8')
+        finally:
+            self.blob.close()
+
+    def compress(self, chunks):
+        """Store the content of this log message compressed in :attr:`blob`.
+
+        The content is compressed to a temporary file as it comes, so it
+        never has to fit in memory. The log itself is not saved.
+
+        :param chunks: the content, as an iterable of strings
+        :returns: the number of bytes of compressed content
+
+        """
+        with tempfile.TemporaryFile() as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as compressed:
+                for chunk in chunks:
+                    compressed.write(chunk.encode('utf-8'))
+
+            size = f.tell()
+            f.seek(0)
+
+            self.content = ''
+            self.compression = 'gzip'
+            self.blob.save('{}.log.gz'.format(self.stream), File(f),
+                           save=False)
+
+        return size
+
 
 def job_result_path(instance, filename):
     """Produce the path to locally store the job results.
 
     :param Result instance: the :class:`Result` instance to produce the path
         for
-    :param str filename: the original filename
+    :param str filename: the original filename, which may include the
+        subdirectories it was found in (e.g. ``"output/1.txt"``)
+
+    >>> from django_remote_submission.models import job_result_path
+    >>> from collections import namedtuple
+    >>> job = namedtuple('Job', ['uuid'])('d6c4b0f6')
+    >>> instance = namedtuple('Result', ['job'])(job)
+    >>> job_result_path(instance, 'output/1.txt')
+    'results/d6c4b0f6/output/1.txt'
+    >>> job_result_path(instance, '../../1.txt')
+    'results/d6c4b0f6/1.txt'
 
     """
-    return 'results/{}/{}'.format(instance.job.uuid, filename)
+    parts = [
+        part for part in filename.replace('\\', '/').split('/')
+        if part not in ('', '.', '..')
+    ]
+    return 'results/{}/{}'.format(instance.job.uuid, '/'.join(parts))
 
 
 class Result(TimeStampedModel):
@@ -414,6 +680,10 @@ class Result(TimeStampedModel):
     >>> result
     <Result: 1.txt <My Job>>
 
+    Results of unchanged files share the :attr:`local_file` of an earlier
+    result (see :class:`.harvest.ResultHarvester`), so the file of a
+    deleted result is left in the storage.
+
     """
 
     remote_filename = models.TextField(
@@ -430,6 +700,21 @@ class Result(TimeStampedModel):
         max_length=250,
     )
 
+    size = models.BigIntegerField(
+        _('Size'),
+        help_text=_('The number of bytes transferred for this result'),
+        null=True,
+        blank=True,
+    )
+
+    checksum = models.CharField(
+        _('Checksum'),
+        help_text=_('The SHA-256 digest of the result file'),
+        max_length=64,
+        blank=True,
+        db_index=True,
+    )
+
     job = models.ForeignKey(
         'Job',
         models.CASCADE,
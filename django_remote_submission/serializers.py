@@ -1,7 +1,9 @@
 """Provide default serializers for managing this package's models."""
 # -*- coding: utf-8 -*-
+from django.db import models
 from rest_framework import serializers
 
+from .logfile import read_logs
 from .models import Server, Job, Log, Result
 
 
@@ -22,7 +24,7 @@ class ServerSerializer(serializers.ModelSerializer):
 
     class Meta:  # noqa: D101
         model = Server
-        fields = ('id', 'title', 'hostname', 'port')
+        fields = ('id', 'title', 'hostname', 'port', 'buffer_size')
 
 
 class JobSerializer(serializers.ModelSerializer):
@@ -47,9 +49,35 @@ class JobSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'program', 'status', 'owner', 'server')
 
 
+class LogListSerializer(serializers.ListSerializer):
+    """Serialize a list of :class:`django_remote_submission.models.Log`
+    instances, such as a page of them.
+
+    The content of the logs stored in the job log files is read with
+    :func:`.logfile.read_logs`, which opens each file once for the whole
+    list.
+
+    """
+
+    def to_representation(self, data):  # noqa: D102
+        if isinstance(data, models.Manager):
+            data = data.all()
+
+        logs = list(data)
+        representations = super(LogListSerializer, self).to_representation(
+            logs)
+        for representation, text in zip(representations, read_logs(logs)):
+            representation['content'] = text
+
+        return representations
+
+
 class LogSerializer(serializers.ModelSerializer):
     """Serialize :class:`django_remote_submission.models.Log` instances.
 
+    The content of compressed logs is decompressed when they are read, and
+    the content of the logs stored in a job log file is read from it.
+
     >>> from django_remote_submission.serializers import LogSerializer
     >>> serializer = LogSerializer(data={
     ...     'id': 1,
@@ -65,11 +93,21 @@ class LogSerializer(serializers.ModelSerializer):
 
     class Meta:  # noqa: D101
         model = Log
-        fields = ('id', 'time', 'content', 'stream', 'job')
+        fields = ('id', 'time', 'content', 'stream', 'job', 'seq')
+        read_only_fields = ('seq',)
+        list_serializer_class = LogListSerializer
+
+    def to_representation(self, instance):  # noqa: D102
+        data = super(LogSerializer, self).to_representation(instance)
+        if not isinstance(self.parent, LogListSerializer):
+            # In a list, the content of all the logs is read at once
+            data['content'] = instance.text
+        return data
 
 
 class ResultSerializer(serializers.ModelSerializer):
 
     class Meta:  # noqa: D101
         model = Result
-        fields = ('id', 'remote_filename', 'local_file', 'job')
+        fields = ('id', 'remote_filename', 'local_file', 'size', 'checksum',
+                  'job')
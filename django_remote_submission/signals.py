@@ -1,30 +1,32 @@
 """Attach signals to this app's models."""
 # -*- coding: utf-8 -*-
-import json
+import functools
 import logging
 
-import channels.layers
-from asgiref.sync import async_to_sync
-
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Job, Log
+from .broadcast import broadcaster
+from .models import Job, Log, logs_created
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
+USERNAME_CACHE_TIMEOUT = 300
+"""The longest time (in seconds) to keep the username of a job's owner in the
+cache."""
 
-def send_message(event):
-    '''
-    Call back function to send message to the browser
-    '''
-    message = event['text']
-    channel_layer = channels.layers.get_channel_layer()
-    # Send message to WebSocket
-    async_to_sync(channel_layer.send)(text_data=json.dumps(
-        message
-    ))
+DEFAULT_RECENT_JOBS = 10
+"""The number of jobs in the snapshot sent to a browser when it connects,
+unless the ``REMOTE_SUBMISSION_RECENT_JOBS`` setting is given."""
+
+RECENT_JOBS_LOCK_TIMEOUT = 10
+"""The longest time (in seconds) a process keeps the right to edit the
+snapshot of a user's recent jobs, in case it dies while editing it."""
 
 
 @receiver(post_save, sender=Job, dispatch_uid='update_job_status_listeners')
@@ -36,25 +38,169 @@ def update_job_status_listeners(sender, instance, **kwargs):
     logger.debug("Job modified: {} :: status = {}.".format(
         instance, instance.status))
 
-    user = instance.owner
-    group_name = 'job-user-{}'.format(user.username)
+    group_name = 'job-user-{}'.format(owner_username(instance))
+
+    message = job_message(instance)
+
+    # Only the latest status of each job is worth sending
+    broadcaster.send(group_name, message, key=instance.id)
+
+    transaction.on_commit(functools.partial(
+        update_recent_jobs, instance.owner_id, message))
 
+
+@receiver(post_delete, sender=Job, dispatch_uid='forget_recent_jobs')
+def forget_recent_jobs(sender, instance, **kwargs):
+    '''
+    Forgets the recent jobs of the owner of a deleted Job, to be read again
+    from the database
+    '''
+    drop_recent_jobs(instance.owner_id)
+
+
+def job_message(job):
+    '''
+    Describes a Job the way the browser expects it
+    '''
+    return {
+        'job_id': job.id,
+        'title': job.title,
+        'status': job.status,
+        'modified': job.modified.isoformat(),
+    }
+
+
+def recent_jobs_key(owner_id):
+    '''
+    Returns the cache key of the recent jobs of a user
+    '''
+    return 'django_remote_submission:recent-jobs:{}'.format(owner_id)
+
+
+def recent_jobs(owner_id):
+    '''
+    Returns the messages for the last modified jobs of a user, newest first,
+    from the cache if they are there
+    '''
+    key = recent_jobs_key(owner_id)
+    messages = cache.get(key)
+    if messages is None:
+        length = getattr(settings, 'REMOTE_SUBMISSION_RECENT_JOBS',
+                         DEFAULT_RECENT_JOBS)
+        jobs = Job.objects.filter(owner_id=owner_id).order_by('-modified')
+        messages = [job_message(job) for job in jobs[:length]]
+        cache.set(key, messages)
+
+    return messages
+
+
+def update_recent_jobs(owner_id, message):
+    '''
+    Moves a modified job to the front of the recent jobs of its owner, if
+    they are in the cache
+
+    Only one process edits the snapshot of a user at a time, holding a lock
+    added to the cache. The others drop the snapshot instead, and mark it as
+    stale first: the editing process then drops the snapshot it wrote back
+    too, so that no update is lost.
+    '''
+    key = recent_jobs_key(owner_id)
+    lock_key = '{}:lock'.format(key)
+    if not cache.add(lock_key, True, RECENT_JOBS_LOCK_TIMEOUT):
+        drop_recent_jobs(owner_id)
+        return
+
+    try:
+        messages = cache.get(key)
+        if messages is None:
+            return
+
+        length = getattr(settings, 'REMOTE_SUBMISSION_RECENT_JOBS',
+                         DEFAULT_RECENT_JOBS)
+        messages = [message] + [m for m in messages
+                                if m['job_id'] != message['job_id']]
+        cache.set(key, messages[:length])
+
+        stale_key = '{}:stale'.format(key)
+        if cache.get(stale_key):
+            cache.delete_many([key, stale_key])
+    finally:
+        cache.delete(lock_key)
+
+
+def drop_recent_jobs(owner_id):
+    '''
+    Drops the recent jobs of a user from the cache, to be read again from
+    the database, even if another process is editing them
+    '''
+    key = recent_jobs_key(owner_id)
+    cache.set('{}:stale'.format(key), True, RECENT_JOBS_LOCK_TIMEOUT)
+    cache.delete(key)
+
+
+def owner_username_key(owner_id):
+    '''
+    Returns the cache key of the username of a user
+    '''
+    return 'django_remote_submission:username:{}'.format(owner_id)
+
+
+def owner_username(job):
+    '''
+    Returns the username of the owner of a job, without querying the
+    database again for the owners in the cache
+    '''
+    owner_field = Job._meta.get_field('owner')
+    if owner_field.is_cached(job):
+        return job.owner.get_username()
+
+    key = owner_username_key(job.owner_id)
+    username = cache.get(key)
+    if username is None:
+        User = get_user_model()
+        username = User.objects.values_list(
+            User.USERNAME_FIELD, flat=True).get(pk=job.owner_id)
+        cache.set(key, username, USERNAME_CACHE_TIMEOUT)
+
+    return username
+
+
+@receiver(post_save, sender=get_user_model(),
+          dispatch_uid='forget_owner_username_on_save')
+@receiver(post_delete, sender=get_user_model(),
+          dispatch_uid='forget_owner_username_on_delete')
+def forget_owner_username(sender, instance, **kwargs):
+    '''
+    Forgets the cached username of a user when it is modified or deleted,
+    for all the processes sharing the cache
+    '''
+    cache.delete(owner_username_key(instance.pk))
+
+
+def log_message(log):
+    '''
+    Describes a Log the way the browser expects it
+
+    The content is only sent for the logs kept in the database. The output
+    kept in a blob can be too large for the channel layer, so the browser
+    fetches it from the API instead: the range of the job's log file from
+    ``jobs/<job_pk>/log/?stream=<stream>&offset=<offset>&length=<length>``,
+    or the compressed log from ``logs/<log_id>/``.
+    '''
     message = {
-        'job_id': instance.id,
-        'title': instance.title,
-        'status': instance.status,
-        'modified': instance.modified.isoformat(),
+        'log_id': log.id,
+        'time': log.time.isoformat(),
+        'stream': log.stream,
+        'seq': log.seq,
     }
 
-    channel_layer = channels.layers.get_channel_layer()
+    if not log.blob:
+        message['content'] = log.content
+    elif log.offset is not None:
+        message['offset'] = log.offset
+        message['length'] = log.length
 
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            'type': 'send_message',
-            'text': message
-        }
-    )
+    return message
 
 
 @receiver(post_save, sender=Log, dispatch_uid='update_job_log_listeners')
@@ -63,25 +209,26 @@ def update_job_log_listeners(sender, instance, **kwargs):
     Sends job status to the browser when a Log is modified
     '''
 
-    logger.debug("Log modified: {} :: content = {}.".format(
-        instance, instance.content))
+    # Only use the job's id, to not query the job on every log
+    logger.debug("Log modified: {} :: job = {} :: seq = {}.".format(
+        instance.pk, instance.job_id, instance.seq))
 
-    job_pk = instance.job.id
-    group_name = 'job-log-{}'.format(job_pk)
+    group_name = 'job-log-{}'.format(instance.job_id)
 
-    message = {
-        'log_id': instance.id,
-        'time': instance.time.isoformat(),
-        'content': instance.content,
-        'stream': instance.stream,
-    }
+    broadcaster.send(group_name, log_message(instance))
+
+
+@receiver(logs_created, sender=Log,
+          dispatch_uid='update_job_log_listeners_bulk')
+def update_job_log_listeners_bulk(sender, logs, **kwargs):
+    '''
+    Sends the Logs created in bulk to the browser, batched with the other
+    messages for each job
+    '''
 
-    channel_layer = channels.layers.get_channel_layer()
+    logger.debug("Logs created: %d.", len(logs))
 
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            'type': 'send_message',
-            'text': message
-        }
+    broadcaster.send_many(
+        ('job-log-{}'.format(log.job_id), log_message(log), None)
+        for log in logs
     )
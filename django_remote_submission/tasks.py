@@ -7,29 +7,30 @@ the current execution thread.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import codecs
 import collections
-import fnmatch
-import io
-import os
-import os.path
-import select
-import socket
 import sys
-import time
+import tempfile
 from threading import Thread
+from django.db import connection
 from django.utils import timezone
 
 import six
-from django.core.files import File
-from paramiko import AuthenticationException, BadHostKeyException
-from paramiko.client import AutoAddPolicy, SSHClient
 
 from celery.utils.log import get_task_logger
 
-from .models import Interpreter, Job, Log, Result
+from .broadcast import broadcaster
+from .harvest import ResultHarvester, is_matching  # noqa: F401
+from .logfile import JobLogFile
+from .models import Job, Log
 from .wrapper.local import LocalWrapper
 from .wrapper.remote import RemoteWrapper
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 logger = get_task_logger(__name__)
 
 
@@ -60,46 +61,101 @@ class LogPolicy(object):
     LOG_TOTAL = 2
     """Combine all of stdout and stderr at the end of the job."""
 
+    LOG_BATCHED = 3
+    """Combine the output received over a short time (see
+    :attr:`LogContainer.flush_interval` and :attr:`LogContainer.flush_size`)
+    into a single Log object."""
 
-def is_matching(filename, patterns=None):
-    """Check if a filename matches the list of positive and negative patterns.
 
-    Positive patterns are strings like ``"1.txt"``, ``"[23].txt"``, or
-    ``"*.txt"``.
+class LogBuffer(object):
+    """Hold the output of one of a job's streams until it is logged.
 
-    Negative patterns are strings like ``"!1.txt"``, ``"![23].txt"``, or
-    ``"!*.txt"``.
+    The output is kept in memory up to ``max_memory`` bytes, and spills to a
+    temporary file past that. A job printing gigabytes of output while its
+    logs are held back (or cannot be saved fast enough) then only uses disk
+    space, not the worker's memory.
 
-    Each pattern is checked in turn, so the list of patterns ``["!*.txt",
-    "1.txt"]`` will still match ``"1.txt"``.
-
-    >>> from django_remote_submission.tasks import is_matching
-    >>> is_matching("1.txt", patterns=["1.txt"])
-    True
-    >>> is_matching("1.txt", patterns=["[12].txt"])
-    True
-    >>> is_matching("1.txt", patterns=["*.txt"])
-    True
-    >>> is_matching("1.txt", patterns=["1.txt", "!*.txt"])
-    False
-    >>> is_matching("1.txt", patterns=["!*.txt", "[12].txt"])
+    >>> from django_remote_submission.tasks import LogBuffer
+    >>> buffer = LogBuffer(max_memory=4)
+    >>> buffer.write(None, 'hello world')
+    >>> buffer.spilled
     True
+    >>> list(buffer.replay(4))
+    ['hell', 'o wo', 'rld']
+    >>> len(buffer)
+    0
 
     """
-    if patterns is None:
-        patterns = ['*']
 
-    is_matching = False
+    def __init__(self, max_memory=1048576):
+        """Instantiate an empty buffer.
+
+        :param int max_memory: the most bytes of output to keep in memory
+
+        """
+        self.max_memory = max_memory
+        """The most bytes of output kept in memory."""
+
+        self.time = None
+        """When the latest output was written."""
+
+        self.size = 0
+        """The number of bytes of output held."""
+
+        self._file = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def spilled(self):
+        """Whether the output held is on disk rather than in memory."""
+        return getattr(self._file, '_rolled', False)
 
-    for pattern in patterns:
-        if not pattern.startswith('!'):
-            if fnmatch.fnmatch(filename, pattern):
-                is_matching = True
-        else:
-            if fnmatch.fnmatch(filename, pattern[1:]):
-                is_matching = False
+    def write(self, now, output):
+        """Append some output.
+
+        :param datetime.datetime now: the time this output was produced
+        :param str output: the output that was produced
+
+        """
+        if self._file is None:
+            self._file = tempfile.SpooledTemporaryFile(self.max_memory)
 
-    return is_matching
+        data = output.encode('utf-8')
+        self._file.write(data)
+        self.size += len(data)
+        self.time = now
+
+    def replay(self, chunk_size):
+        """Empty the buffer, and return the output it held.
+
+        :param int chunk_size: the number of bytes to read at a time
+        :returns: an iterator over the output, in chunks of about
+            ``chunk_size`` bytes
+
+        """
+        f, self._file, self.size = self._file, None, 0
+        if f is None:
+            return iter(())
+
+        return self._read(f, chunk_size)
+
+    @staticmethod
+    def _read(f, chunk_size):
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        try:
+            f.seek(0)
+            for data in iter(lambda: f.read(chunk_size), b''):
+                text = decoder.decode(data)
+                if text:
+                    yield text
+
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
+        finally:
+            f.close()
 
 
 class LogContainer(object):
@@ -127,15 +183,25 @@ class LogContainer(object):
 
     """
 
-    LogLine = collections.namedtuple('LogLine', [
-        'now', 'output',
-    ])
-
-    def __init__(self, job, log_policy):
+    def __init__(self, job, log_policy, flush_interval=0.5,
+                 flush_size=65536, writer=None, max_memory=1048576,
+                 compress_size=None, log_file=False):
         """Instantiate a log container.
 
         :param models.Job job: the job these logs are coming from
         :param LogPolicy log_policy: the policy to use for logging
+        :param float flush_interval: with :const:`LogPolicy.LOG_BATCHED`, the
+            longest time (in seconds) to hold back output
+        :param int flush_size: with :const:`LogPolicy.LOG_BATCHED`, the most
+            characters of output to hold back
+        :param LogWriter writer: the writer to hand the logs to, instead of
+            saving them in the calling thread
+        :param int max_memory: the most bytes of output to hold in memory for
+            each stream before spilling it to disk (see :class:`LogBuffer`)
+        :param int compress_size: the fewest bytes of a stream's output to
+            store compressed in file storage instead of the database
+        :param bool log_file: append the output to the job's log files, and
+            only index it in the database (see :class:`logfile.JobLogFile`)
 
         """
         self.job = job
@@ -144,29 +210,70 @@ class LogContainer(object):
         self.log_policy = log_policy
         """The policy to use when logging."""
 
-        self._stdout = []
-        """The list of log lines that came from stdout."""
+        self.flush_interval = flush_interval
+        """The longest time (in seconds) output is held back when batching."""
+
+        self.flush_size = flush_size
+        """The most characters of output held back when batching."""
+
+        self._pending_size = 0
+        """The number of characters of output waiting to be flushed."""
 
-        self._stderr = []
-        """The list of log lines that came from stderr."""
+        self._pending_since = None
+        """When the oldest output waiting to be flushed was written."""
 
-    def _write(self, lst, now, output):
-        """Append the current log entry to the given list and flush.
+        self.writer = writer
+        """The :class:`LogWriter` saving the logs, if any."""
 
-        :param lst: either :attr:`stdout` or :attr:`stderr`
+        self.max_memory = max_memory
+        """The most bytes of output held in memory for each stream."""
+
+        self.compress_size = compress_size
+        """The fewest bytes of output stored compressed, if any."""
+
+        self.log_files = {}
+        """The :class:`logfile.JobLogFile` of each stream, if the output is
+        appended to the job's log files."""
+
+        if log_file:
+            self.log_files = {
+                stream: JobLogFile(job, stream)
+                for stream in ('stdout', 'stderr')
+            }
+
+        self._unsent = []
+        """The logs the :attr:`writer` had no room for yet."""
+
+        self._stdout = LogBuffer(max_memory)
+        """The output that came from stdout."""
+
+        self._stderr = LogBuffer(max_memory)
+        """The output that came from stderr."""
+
+    def _write(self, buffer, now, output):
+        """Append the current log entry to the given buffer and flush.
+
+        :param LogBuffer buffer: either :attr:`_stdout` or :attr:`_stderr`
         :param datetime.datetime now: the time this line was produced
         :param str output: the line of output from the job
 
         """
         if self.log_policy != LogPolicy.LOG_NONE:
-            lst.append(LogContainer.LogLine(
-                now=now,
-                output=output,
-            ))
+            buffer.write(now, output)
 
         if self.log_policy == LogPolicy.LOG_LIVE:
             self.flush()
 
+        elif self.log_policy == LogPolicy.LOG_BATCHED:
+            if self._pending_since is None:
+                self._pending_since = now
+
+            self._pending_size += len(output)
+            if self._pending_size >= self.flush_size:
+                self.flush()
+            else:
+                self.tick(now)
+
     def write_stdout(self, now, output):
         """Write some output from a job's stdout stream.
 
@@ -185,6 +292,31 @@ class LogContainer(object):
         """
         self._write(self._stderr, now, output)
 
+    @property
+    def tick_interval(self):
+        """How often :meth:`tick` needs to be called, if at all."""
+        if self.log_policy == LogPolicy.LOG_BATCHED:
+            return self.flush_interval
+
+        return None
+
+    def tick(self, now):
+        """Flush the output held back for longer than :attr:`flush_interval`.
+
+        With :const:`LogPolicy.LOG_BATCHED`, this should be called regularly
+        while the job runs, even if it produces no output, so the output is
+        never held back for long. For other policies it does nothing.
+
+        :param datetime.datetime now: the current time
+
+        """
+        if self._pending_since is None:
+            return
+
+        elapsed = (now - self._pending_since).total_seconds()
+        if elapsed >= self.flush_interval:
+            self.flush()
+
     def flush(self):
         """Flush the stdout and stderr lists to Django models.
 
@@ -195,32 +327,276 @@ class LogContainer(object):
         There is no penalty for calling this method multiple times, so it can
         be called at the end of the job regardless of which log policy is used.
 
+        Both streams are saved with a single
+        :meth:`models.LogManager.bulk_ingest`, so the listeners of the job's
+        logs are notified once. Output over :attr:`max_memory` is saved in
+        several logs, a batch at a time, so it never has to fit in memory.
+        Output of at least :attr:`compress_size` bytes is instead saved as a
+        single log, compressed in file storage (see
+        :meth:`models.Log.compress`), which is what happens to all of a job's
+        output with :const:`LogPolicy.LOG_TOTAL` and a ``compress_size``.
+        With :attr:`log_files`, the output is appended to them, and each
+        stream's output is indexed by a single log.
+
+        With a :attr:`writer`, the logs are only handed to it. While it is
+        busy, the output stays in the buffers, spilling to disk if there is
+        too much of it, and is handed over on a later flush (see
+        :meth:`close`).
+
         """
-        if len(self._stdout) > 0:
-            Log.objects.create(
-                time=self._stdout[-1].now,
-                content=''.join(line.output for line in self._stdout),
-                stream='stdout',
-                job=self.job,
-            )
+        if self.writer is not None and self._unsent:
+            if not self.writer.write(self._unsent):
+                return
+
+            self._unsent = []
+
+        logs = []
+        size = 0
+        for stream, buffer in [('stdout', self._stdout),
+                               ('stderr', self._stderr)]:
+            time = buffer.time
+            if not len(buffer):
+                continue
+
+            if stream in self.log_files:
+                logs.append(self.log_files[stream].log(
+                    time, buffer.replay(self.max_memory)))
+                continue
 
-            del self._stdout[:]
+            if (self.compress_size is not None and
+                    len(buffer) >= self.compress_size):
+                log = Log(time=time, stream=stream, job=self.job)
+                log.compress(buffer.replay(self.max_memory))
+                logs.append(log)
+                continue
 
-        if len(self._stderr) > 0:
-            Log.objects.create(
-                time=self._stderr[-1].now,
-                content=''.join(line.output for line in self._stderr),
-                stream='stderr',
-                job=self.job,
-            )
+            for content in buffer.replay(self.max_memory):
+                logs.append(Log(
+                    time=time,
+                    content=content,
+                    stream=stream,
+                    job=self.job,
+                ))
+
+                size += len(content)
+                if size >= self.max_memory:
+                    self._save(logs, block=True)
+                    logs = []
+                    size = 0
+
+        self._save(logs)
+
+        self._pending_size = 0
+        self._pending_since = None
+
+    def _save(self, logs, block=False):
+        """Save logs, or hand them to the :attr:`writer`.
+
+        :param list(models.Log) logs: the unsaved logs
+        :param bool block: wait for the writer to have room for them
+
+        """
+        if self.writer is None:
+            Log.objects.bulk_ingest(logs)
+            return
+
+        self._unsent.extend(logs)
+        if self._unsent and self.writer.write(self._unsent, block):
+            self._unsent = []
+
+    def close(self):
+        """Flush the remaining output and wait until all of it is saved.
+
+        This should be called at the end of the job instead of
+        :meth:`flush` when a :attr:`writer` is used.
+
+        """
+        if self.writer is not None and self._unsent:
+            self.writer.write(self._unsent, block=True)
+            self._unsent = []
+
+        self.flush()
+
+        if self.writer is not None:
+            if self._unsent:
+                self.writer.write(self._unsent, block=True)
+                self._unsent = []
+
+            self.writer.drain()
+
+
+class LogWriter(object):
+    """Save logs from a background thread.
+
+    Saving logs (and notifying their listeners) can be slow. When that
+    happens in the loop reading a job's output, the job itself ends up
+    blocked on a full pipe. A :class:`LogContainer` given a writer only puts
+    its logs in a bounded queue, and the writer's thread saves them, several
+    flushes at a time if they pile up::
+
+        writer = LogWriter()
+        logs = LogContainer(job, LogPolicy.LOG_LIVE, writer=writer)
+        try:
+            wrapper.exec_command(...)
+            logs.close()
+        finally:
+            writer.close()
+
+    The thread uses its own database connection, which it closes when the
+    writer is closed.
+
+    """
+
+    def __init__(self, max_pending=100):
+        """Start a log writer.
+
+        :param int max_pending: the most batches of logs to queue up
+
+        """
+        self._queue = queue.Queue(max_pending)
+        self._errors = []
+        self._thread = Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, logs, block=False):
+        """Queue logs to be saved.
+
+        :param list(models.Log) logs: the unsaved logs
+        :param bool block: wait for room in the queue if it is full
+        :returns: whether the logs were queued
+
+        """
+        try:
+            self._queue.put(list(logs), block)
+        except queue.Full:
+            return False
+
+        return True
+
+    def drain(self):
+        """Wait until all the queued logs are saved.
+
+        The first error raised while saving logs is raised again here.
+
+        """
+        self._queue.join()
+
+        if self._errors:
+            six.reraise(*self._errors.pop(0))
+
+    def close(self):
+        """Save the queued logs and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+        if self._errors:
+            six.reraise(*self._errors.pop(0))
+
+    def _run(self):
+        try:
+            done = False
+            while not done:
+                batches = [self._queue.get()]
+                while True:
+                    try:
+                        batches.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                logs = []
+                for batch in batches:
+                    if batch is None:
+                        done = True
+                    else:
+                        logs.extend(batch)
+
+                try:
+                    Log.objects.bulk_ingest(logs)
+                except Exception:
+                    logger.exception('Could not save %d logs', len(logs))
+                    self._errors.append(sys.exc_info())
+
+                for _ in batches:
+                    self._queue.task_done()
+        finally:
+            connection.close()
+
+
+def _close_log_writer(writer, failing):
+    """Close the log writer of a task, if it has one.
+
+    :param LogWriter writer: the writer, or ``None``
+    :param bool failing: whether the task is already failing, in which case
+        an error of the writer is only logged, so that it does not replace
+        the task's own error
+
+    """
+    if writer is None:
+        return
+
+    if not failing:
+        writer.close()
+        return
+
+    try:
+        writer.close()
+    except Exception:
+        logger.exception('Could not save the logs')
+
+
+def _upload_program(wrapper, job):
+    """Write the job's program to its remote directory.
 
-            del self._stderr[:]
+    Returns the modification time of the uploaded program, as seen by the
+    remote server. Files modified since then are the job's results.
+
+    :param RemoteWrapper wrapper: a connected wrapper
+    :param models.Job job: the job to upload
+
+    """
+    wrapper.chdir(job.remote_directory)
+
+    with wrapper.open(job.remote_filename, 'wt') as f:
+        f.write(job.program)
+
+    return wrapper.stat(job.remote_filename).st_mtime
+
+
+def _job_command(job, logs, timeout):
+    """Describe how to run a job, as accepted by
+    :meth:`RemoteWrapper.exec_command`.
+
+    :param models.Job job: the job to run
+    :param LogContainer logs: the container collecting the job's output
+    :param datetime.timedelta timeout: the timeout for running the job
+
+    """
+    interp = job.interpreter.path
+    args = job.interpreter.arguments
+    filename = job.remote_filename
+
+    return dict(
+        args=[interp] + args + [filename],
+        workdir=job.remote_directory,
+        timeout=timeout,
+        stdout_handler=logs.write_stdout,
+        stderr_handler=logs.write_stderr,
+        tick_handler=logs.tick,
+    )
 
 
 @shared_task
 def submit_job_to_server(job_pk, password=None, public_key_filename=None, username=None,
                          timeout=None, log_policy=LogPolicy.LOG_LIVE,
-                         store_results=None, remote=True):
+                         store_results=None, remote=True, buffer_size=None,
+                         line_buffered=True, download_workers=4,
+                         chunk_size=None, max_file_size=None,
+                         max_total_size=None, skip_unchanged=False,
+                         recursive=False, filter_remotely=False,
+                         log_flush_interval=0.5, log_flush_size=65536,
+                         log_writer=False, log_max_memory=1048576,
+                         log_compress_size=None, log_file=False):
     """Submit a job to the remote server.
 
     This can be used as a Celery task, if the library is installed and running.
@@ -232,8 +608,40 @@ def submit_job_to_server(job_pk, password=None, public_key_filename=None, userna
         different from the owner of the job
     :param datetime.timedelta timeout: the timeout for running the job
     :param LogPolicy log_policy: the policy to use for logging
+    :param float log_flush_interval: with :const:`LogPolicy.LOG_BATCHED`, the
+        longest time (in seconds) to hold back output before logging it
+    :param int log_flush_size: with :const:`LogPolicy.LOG_BATCHED`, the most
+        characters of output to hold back before logging it
+    :param bool log_writer: save the logs from a :class:`LogWriter` thread,
+        so a slow database never holds up reading the job's output
+    :param int log_max_memory: the most bytes of each stream's output to hold
+        in memory before spilling it to a temporary file
+    :param int log_compress_size: the fewest bytes of a stream's output to
+        log compressed in file storage instead of the database; with
+        :const:`LogPolicy.LOG_TOTAL`, this keeps large logs out of the
+        database
+    :param bool log_file: append the output to one file per job and stream,
+        with the logs only indexing it, so any part of it can be read cheaply
     :param list(str) store_results: the patterns to use for the results to store
     :param bool remote: Either runs this task locally on the host or in a remote server.
+    :param int buffer_size: the number of bytes of output to read at a time,
+        defaults to the :attr:`models.Server.buffer_size` of the job's server
+    :param bool line_buffered: only log whole lines of output (a line
+        longer than ``buffer_size`` is still logged in pieces)
+    :param int download_workers: the most result files to download at the
+        same time
+    :param int chunk_size: the number of bytes of a result file to transfer
+        at a time
+    :param int max_file_size: skip result files larger than this many bytes
+    :param int max_total_size: stop storing a job's results once they add
+        up to more than this many bytes
+    :param bool skip_unchanged: don't transfer result files with the same
+        name and checksum as an earlier result, but share its stored file
+    :param bool recursive: also store the results in subdirectories of the
+        remote directory, keeping their relative path
+    :param bool filter_remotely: have the server only list the files that
+        were modified by the job and match ``store_results``, which is faster
+        for remote directories holding many files
 
     """
 
@@ -252,73 +660,291 @@ def submit_job_to_server(job_pk, password=None, public_key_filename=None, userna
         port=job.server.port,
     )
 
+    writer = LogWriter() if log_writer else None
+
     logs = LogContainer(
         job=job,
         log_policy=log_policy,
+        flush_interval=log_flush_interval,
+        flush_size=log_flush_size,
+        writer=writer,
+        max_memory=log_max_memory,
+        compress_size=log_compress_size,
+        log_file=log_file,
     )
 
-    with wrapper.connect(password, public_key_filename):
-        wrapper.chdir(job.remote_directory)
+    try:
+        with wrapper.connect(password, public_key_filename):
+            script_mtime = _upload_program(wrapper, job)
 
-        with wrapper.open(job.remote_filename, 'wt') as f:
-            f.write(job.program)
+            job.status = Job.STATUS.submitted
+            job.save()
+
+            job_status = wrapper.exec_command(
+                buffer_size=buffer_size or job.server.buffer_size,
+                line_buffered=line_buffered,
+                tick_interval=logs.tick_interval,
+                **_job_command(job, logs, timeout)
+            )
+
+            logs.close()
+
+            job.status = (Job.STATUS.success if job_status
+                          else Job.STATUS.failure)
+            job.save()
+
+            harvester = ResultHarvester(
+                wrapper, job,
+                workers=download_workers,
+                chunk_size=chunk_size,
+                max_file_size=max_file_size,
+                max_total_size=max_total_size,
+                skip_unchanged=skip_unchanged,
+                recursive=recursive,
+                filter_remotely=filter_remotely,
+            )
+            results = harvester.harvest(script_mtime, store_results)
+    except BaseException:
+        _close_log_writer(writer, failing=True)
+        raise
+    else:
+        _close_log_writer(writer, failing=False)
+    finally:
+        # The timer sending the held back updates (such as the job's final
+        # status) does not outlive the worker
+        broadcaster.flush()
+
+    return { r.remote_filename: r.pk for r in results }
 
-        time.sleep(1)
 
+def _submit_job_group(wrapper, jobs, logs, timeout, store_results,
+                      buffer_size, line_buffered, max_parallel,
+                      harvester_options):
+    """Run jobs side by side over one connection, and store their results.
+
+    The results in each remote directory are listed once for all the jobs
+    using it.
+
+    :param RemoteWrapper wrapper: a wrapper connected to the jobs' server
+    :param list(models.Job) jobs: the jobs to run
+    :param dict logs: the :class:`LogContainer` of each job, by primary key
+    :param dict harvester_options: the options of the
+        :class:`ResultHarvester` of each job
+    :returns: the stored results of each job, keyed by the job's primary key
+
+    """
+    script_mtimes = {}
+    for job in jobs:
+        wrapper.reset_directory()
+        script_mtimes[job.pk] = _upload_program(wrapper, job)
+
+    for job in jobs:
         job.status = Job.STATUS.submitted
         job.save()
 
-        interp = job.interpreter.path
-        workdir = job.remote_directory
-        args = job.interpreter.arguments
-        filename = job.remote_filename
-
-        job_status = wrapper.exec_command(
-            [interp] + args + [filename],
-            workdir,
-            timeout=timeout,
-            stdout_handler=logs.write_stdout,
-            stderr_handler=logs.write_stderr,
-        )
+    job_statuses = wrapper.exec_commands(
+        [_job_command(job, logs[job.pk], timeout) for job in jobs],
+        buffer_size=buffer_size,
+        line_buffered=line_buffered,
+        max_parallel=max_parallel,
+        tick_interval=logs[jobs[0].pk].tick_interval,
+    )
 
-        logs.flush()
+    for job, job_status in zip(jobs, job_statuses):
+        logs[job.pk].close()
 
-        job.status = Job.STATUS.success if job_status else Job.STATUS.failure
+        job.status = (Job.STATUS.success if job_status
+                      else Job.STATUS.failure)
         job.save()
 
-        file_attrs = wrapper.listdir_attr()
-        file_map = { attr.filename: attr for attr in file_attrs }
-        script_attr = file_map[job.remote_filename]
-        script_mtime = script_attr.st_mtime
+    directories = collections.OrderedDict()
+    for job in jobs:
+        directories.setdefault(job.remote_directory, []).append(job)
 
-        results = []
-        for attr in file_attrs:
-            # logger.debug('Listing directory: {!r}'.format(attr))
+    results = {}
+    for remote_directory, directory_jobs in directories.items():
+        wrapper.reset_directory()
+        wrapper.chdir(remote_directory)
 
-            if attr is script_attr:
-                continue
+        listing = None
+        for job in directory_jobs:
+            harvester = ResultHarvester(wrapper, job, **harvester_options)
+            if listing is None:
+                listing = harvester.list_files(
+                    min(script_mtimes[j.pk] for j in directory_jobs),
+                    store_results,
+                )
 
-            if attr.st_mtime < script_mtime:
-                continue
+            results[job.pk] = {
+                r.remote_filename: r.pk
+                for r in harvester.harvest(script_mtimes[job.pk],
+                                           store_results, listing)
+            }
 
-            if not is_matching(attr.filename, store_results):
-                # logger.debug('Listing directory: is_matching: {}'.format(attr.filename))
-                continue
-            else:
-                # logger.debug('Listing directory: not is_matching: {}'.format(attr.filename))
-                pass
+    return results
 
-            result = Result.objects.create(
-                remote_filename=attr.filename,
-                job=job,
-            )
 
-            with wrapper.open(attr.filename, 'rb') as f:
-                result.local_file.save(attr.filename, File(f), save=True)
+@shared_task
+def submit_jobs_to_server(job_pks, password=None, public_key_filename=None,
+                          username=None, timeout=None,
+                          log_policy=LogPolicy.LOG_LIVE, store_results=None,
+                          remote=True, buffer_size=None, line_buffered=True,
+                          max_parallel=None, download_workers=4,
+                          chunk_size=None, max_file_size=None,
+                          max_total_size=None, skip_unchanged=False,
+                          recursive=False, filter_remotely=False,
+                          log_flush_interval=0.5, log_flush_size=65536,
+                          log_writer=False, log_max_memory=1048576,
+                          log_compress_size=None, log_file=False):
+    """Submit several jobs at once, connecting once to each of their servers.
+
+    The jobs are grouped by server (and by remote user). For each group, all
+    the programs are uploaded through one SFTP session, and the jobs run
+    side by side on their own channels of a single SSH connection, each one
+    logging to its own :class:`LogContainer`. Their results are then stored
+    with a single listing of each remote directory. This is meant for bursts
+    of many similar jobs, such as parameter sweeps.
+
+    Jobs that share a remote directory also see each other's output files
+    when their results are stored, so give each job its own directory if
+    ``store_results`` matters.
+
+    If a group cannot be submitted (e.g. its server refuses the
+    credentials), the error is logged, the jobs of the group that did not
+    finish are marked as failed, and the other groups are still submitted.
 
-            results.append(result)
+    This can be used as a Celery task, if the library is installed and running.
 
-    return { r.remote_filename: r.pk for r in results }
+    :param list(int) job_pks: the primary keys of the :class:`models.Job`
+        instances to submit
+    :param str password: the password of the user submitting the jobs
+    :param public_key_filename: the path where it is.
+    :param str username: the username of the user submitting, if it is
+        different from the owners of the jobs
+    :param datetime.timedelta timeout: the timeout for running each job
+    :param LogPolicy log_policy: the policy to use for logging
+    :param float log_flush_interval: with :const:`LogPolicy.LOG_BATCHED`, the
+        longest time (in seconds) to hold back output before logging it
+    :param int log_flush_size: with :const:`LogPolicy.LOG_BATCHED`, the most
+        characters of output to hold back before logging it
+    :param bool log_writer: save the logs from a :class:`LogWriter` thread,
+        so a slow database never holds up reading the job's output
+    :param int log_max_memory: the most bytes of each stream's output to hold
+        in memory before spilling it to a temporary file
+    :param int log_compress_size: the fewest bytes of a stream's output to
+        log compressed in file storage instead of the database; with
+        :const:`LogPolicy.LOG_TOTAL`, this keeps large logs out of the
+        database
+    :param bool log_file: append the output to one file per job and stream,
+        with the logs only indexing it, so any part of it can be read cheaply
+    :param list(str) store_results: the patterns to use for the results to store
+    :param bool remote: Either runs this task locally on the host or in a remote server.
+    :param int buffer_size: the number of bytes of output to read at a time,
+        defaults to the :attr:`models.Server.buffer_size` of the server
+    :param bool line_buffered: only log whole lines of output
+    :param int max_parallel: the most jobs to run at the same time on each
+        server, which should be under the server's ``MaxSessions`` (all at
+        once by default)
+    :param int download_workers: the most result files to download at the
+        same time
+    :param int chunk_size: the number of bytes of a result file to transfer
+        at a time
+    :param int max_file_size: skip result files larger than this many bytes
+    :param int max_total_size: stop storing a job's results once they add
+        up to more than this many bytes
+    :param bool skip_unchanged: don't transfer result files with the same
+        name and checksum as an earlier result, but share its stored file
+    :param bool recursive: also store the results in subdirectories of the
+        remote directory, keeping their relative path
+    :param bool filter_remotely: have the server only list the files that
+        were modified by the job and match ``store_results``, which is faster
+        for remote directories holding many files
+    :returns: the stored results of each job, keyed by the job's primary
+        key, leaving out the jobs of the groups that could not be submitted
+
+    """
+
+    logger.debug("submit_jobs_to_server: %s", locals().keys())
+
+    wrapper_cls = RemoteWrapper if remote else LocalWrapper
+
+    jobs = list(
+        Job.objects
+        .filter(pk__in=job_pks)
+        .select_related('server', 'interpreter', 'owner')
+        .order_by('pk')
+    )
+
+    if len({(job.server_id, job.remote_directory, job.remote_filename)
+            for job in jobs}) < len(jobs):
+        raise ValueError('Each job needs its own remote filename')
+
+    groups = collections.OrderedDict()
+    for job in jobs:
+        key = (job.server, username or job.owner.username)
+        groups.setdefault(key, []).append(job)
+
+    harvester_options = dict(
+        workers=download_workers,
+        chunk_size=chunk_size,
+        max_file_size=max_file_size,
+        max_total_size=max_total_size,
+        skip_unchanged=skip_unchanged,
+        recursive=recursive,
+        filter_remotely=filter_remotely,
+    )
+
+    writer = LogWriter() if log_writer else None
+
+    results = {}
+    try:
+        for (server, group_username), group in groups.items():
+            wrapper = wrapper_cls(
+                hostname=server.hostname,
+                username=group_username,
+                port=server.port,
+            )
+
+            logs = {
+                job.pk: LogContainer(job=job, log_policy=log_policy,
+                                     flush_interval=log_flush_interval,
+                                     flush_size=log_flush_size,
+                                     writer=writer,
+                                     max_memory=log_max_memory,
+                                     compress_size=log_compress_size,
+                                     log_file=log_file)
+                for job in group
+            }
+
+            try:
+                with wrapper.connect(password, public_key_filename):
+                    results.update(_submit_job_group(
+                        wrapper, group, logs, timeout, store_results,
+                        buffer_size=buffer_size or server.buffer_size,
+                        line_buffered=line_buffered,
+                        max_parallel=max_parallel,
+                        harvester_options=harvester_options,
+                    ))
+            except Exception:
+                logger.exception('Could not submit jobs %s to %s as %s',
+                                 [job.pk for job in group], server,
+                                 group_username)
+                for job in group:
+                    if job.status in (Job.STATUS.initial,
+                                      Job.STATUS.submitted):
+                        job.status = Job.STATUS.failure
+                        job.save()
+    except BaseException:
+        _close_log_writer(writer, failing=True)
+        raise
+    else:
+        _close_log_writer(writer, failing=False)
+    finally:
+        # The timer sending the held back updates (such as the job's final
+        # status) does not outlive the worker
+        broadcaster.flush()
+
+    return results
 
 
 @shared_task
@@ -362,12 +988,10 @@ def copy_job_to_server(job_pk, password=None, public_key_filename=None, username
         with wrapper.open(job.remote_filename, 'wt') as f:
             f.write(job.program)
 
-        time.sleep(1)
-
         job.status = Job.STATUS.submitted
         job.save()
 
-        log = Log(
+        Log.objects.create(
             time=timezone.now(),
             content='File {} successfully copied to {}.'.format(
                 job.remote_filename, job.remote_directory,
@@ -375,7 +999,6 @@ def copy_job_to_server(job_pk, password=None, public_key_filename=None, username
             stream='stdout',
             job=job,
         )
-        log.save()
 
         job.status =  Job.STATUS.success
         job.save()
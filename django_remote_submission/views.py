@@ -3,10 +3,14 @@
 import django_filters
 
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
 from django.views.generic import TemplateView
 
+from .logfile import JobLogFile
 from .models import Server, Job, Log, Result
 from .serializers import (
     ServerSerializer, JobSerializer, LogSerializer, ResultSerializer
@@ -25,6 +29,23 @@ class StandardPagination(PageNumberPagination):
 #
 
 
+def _int_param(request, name, default=None):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+
+    if value < 0:
+        raise ValidationError({name: 'Not a non-negative integer: {!r}'.format(
+            request.query_params[name])})
+
+    return value
+
+
 class ServerViewSet(viewsets.ModelViewSet):
     """Allow users to create, read, and update :class:`Server` instances."""
 
@@ -46,9 +67,64 @@ class JobViewSet(viewsets.ModelViewSet):
     filter_fields = ('title', 'program', 'status', 'owner', 'server')
     pagination_class = StandardPagination
 
+    log_length = 65536
+    """The number of bytes :meth:`log` reads when no ``length`` is given."""
+
+    log_max_length = 1048576
+    """The most bytes :meth:`log` reads at once."""
+
+    @action(detail=True)
+    def log(self, request, pk=None):
+        """Read a range of the output in the job's log file.
+
+        This is the output of jobs submitted with ``log_file=True`` (see
+        :class:`logfile.JobLogFile`). The ``stream`` query parameter is
+        either ``stdout`` (the default) or ``stderr``, and the range is
+        either the last ``tail`` bytes, or ``length`` bytes from ``offset``
+        (the first :attr:`log_length` bytes by default). No more than
+        :attr:`log_max_length` bytes are read at once: the rest of the
+        output can be read from the returned ``next_offset``.
+
+        """
+        job = self.get_object()
+
+        stream = request.query_params.get('stream', 'stdout')
+        if stream not in dict(Log.STD_STREAM_CHOICES):
+            raise ValidationError({'stream': 'Not a stream: {!r}'.format(
+                stream)})
+
+        log_file = JobLogFile(job, stream)
+        size = log_file.size
+
+        tail = _int_param(request, 'tail')
+        if tail is not None:
+            length = min(tail, self.log_max_length)
+            offset = max(0, size - length)
+        else:
+            offset = _int_param(request, 'offset', 0)
+            length = min(_int_param(request, 'length', self.log_length),
+                         self.log_max_length)
+
+        content = log_file.read(offset, length)
+
+        return Response({
+            'stream': stream,
+            'offset': offset,
+            'length': len(content),
+            'next_offset': offset + len(content),
+            'size': size,
+            'content': content.decode('utf-8', 'replace'),
+        })
+
 
 class LogViewSet(viewsets.ModelViewSet):
-    """Allow users to create, read, and update :class:`Log` instances."""
+    """Allow users to create, read, and update :class:`Log` instances.
+
+    With the ``since`` query parameter, only the logs numbered after it (see
+    :attr:`models.Log.seq`) are listed, in order, so the new logs of a job
+    can be fetched with ``?job=<pk>&since=<seq>``.
+
+    """
 
     queryset = Log.objects.all()
     serializer_class = LogSerializer
@@ -57,6 +133,15 @@ class LogViewSet(viewsets.ModelViewSet):
     filter_fields = ('time', 'content', 'stream', 'job')
     pagination_class = StandardPagination
 
+    def get_queryset(self):  # noqa: D102
+        queryset = super(LogViewSet, self).get_queryset()
+
+        since = _int_param(self.request, 'since')
+        if since is not None:
+            queryset = queryset.filter(seq__gt=since).order_by('job', 'seq')
+
+        return queryset
+
 
 class ResultViewSet(viewsets.ModelViewSet):
     """Allow users to create, read, and update :class:`Result` instances."""
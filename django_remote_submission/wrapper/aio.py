@@ -0,0 +1,438 @@
+"""Provides asyncio counterparts of the Remote and Local wrappers.
+
+With the blocking wrappers, each job being supervised ties up a thread (or a
+Celery worker) for as long as it runs. The wrappers in this module have the
+same API, except that their methods are coroutines, so a single event loop
+can supervise hundreds of mostly idle jobs at once::
+
+    wrapper = AsyncRemoteWrapper(hostname='example.com', username='john')
+    await wrapper.connect(password='p4ssw0rd')
+    try:
+        await wrapper.chdir('/tmp/job/')
+        status = await wrapper.exec_command(
+            args=['python', '-u', 'job.py'],
+            workdir='/tmp/job/',
+            stdout_handler=lambda now, output: print(output),
+        )
+    finally:
+        await wrapper.close()
+
+The handlers given to :meth:`AsyncRemoteWrapper.exec_command` may be plain
+functions or coroutine functions, e.g. ``sync_to_async(logs.write_stdout)``
+to keep database access off the event loop.
+
+:class:`AsyncRemoteWrapper` is built on asyncssh_, which is an optional
+dependency (``pip install django-remote-submission[async]``), while
+:class:`AsyncLocalWrapper` only uses :mod:`asyncio` subprocesses.
+
+.. _asyncssh: https://asyncssh.readthedocs.io/
+
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import asyncio
+import inspect
+import logging
+import os
+import os.path
+import posixpath
+import stat
+from collections import namedtuple
+
+from django.utils.timezone import now
+
+try:
+    import asyncssh
+except ImportError:  # pragma: no cover
+    asyncssh = None
+
+from .remote import RemoteWrapper
+from .stream import DEFAULT_BUFFER_SIZE, StreamReader
+
+logger = logging.getLogger(__name__)
+
+Attr = namedtuple('Attr', ['filename', 'st_mtime', 'st_size'])
+"""The attributes of a file, as returned by
+:meth:`AsyncRemoteWrapper.listdir_attr` and :meth:`AsyncRemoteWrapper.stat`.
+"""
+
+
+class AsyncRemoteWrapper(object):
+    """
+    Wrapper around asyncssh with the API of the ``RemoteWrapper``, as
+    coroutines.
+    """
+
+    def __init__(self, hostname, username, port=22):
+        """Initialize the wrapper.
+
+        :param str hostname: the hostname of the server to connect to
+        :param str username: the username of the user on the remote server
+        :param int port: the SSH port to connect to
+
+        """
+        self.hostname = hostname
+        self.username = username
+        self.port = port
+
+        self._connection = None
+        """The asyncssh connection"""
+
+        self._sftp = None
+        """The asyncssh SFTP client"""
+
+    async def __aenter__(self):
+        """Allow the use of ``async with wrapper:``."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Allow the use of ``async with wrapper:``."""
+        await self.close()
+
+    async def connect(self, password=None, public_key_filename=None):
+        """Connect to the remote server with the given credentials.
+
+        :param str password: the password of the remote user
+        :param str public_key_filename: the path to the private key file to
+            try first, e.g. the one installed by
+            ``RemoteWrapper.deploy_key_if_it_does_not_exist``
+
+        """
+        if asyncssh is None:
+            raise RuntimeError(
+                'asyncssh is needed to connect to remote servers '
+                'asynchronously')
+
+        logger.debug('Connecting to {}@{}:{}'.format(
+            self.username, self.hostname, self.port))
+
+        client_keys = ()
+        if public_key_filename is not None:
+            client_keys = [public_key_filename]
+
+        self._connection = await asyncssh.connect(
+            self.hostname,
+            port=self.port,
+            username=self.username,
+            password=password,
+            client_keys=client_keys,
+            known_hosts=None,
+        )
+        self._sftp = await self._connection.start_sftp_client()
+        return self
+
+    async def close(self):
+        """Close any open connections and clean up."""
+        if self._sftp is not None:
+            self._sftp.exit()
+            self._sftp = None
+
+        if self._connection is not None:
+            self._connection.close()
+            await self._connection.wait_closed()
+            self._connection = None
+
+    async def chdir(self, remote_directory):
+        """Change directories to the remote directory, creating it if
+        needed.
+
+        :param str remote_directory: the directory to change to
+
+        """
+        await self._sftp.makedirs(remote_directory, exist_ok=True)
+        await self._sftp.chdir(remote_directory)
+
+    async def open(self, filename, mode):
+        """Open a file from the last used remote directory.
+
+        The methods of the returned file (``read``, ``write``, ``close``...)
+        are coroutines.
+
+        :param str filename: the name of the file to open
+        :param str mode: the mode to use to open the file
+
+        """
+        # asyncssh opens files in text mode (as UTF-8) unless the mode has
+        # a "b", and rejects an explicit "t"
+        return await self._sftp.open(filename, mode.replace('t', ''))
+
+    async def stat(self, filename):
+        """Get the attributes of a file in the last used remote directory.
+
+        :param str filename: the name of the file
+        :returns: an :data:`Attr`
+
+        """
+        attrs = await self._sftp.stat(filename)
+        return Attr(filename=filename, st_mtime=attrs.mtime,
+                    st_size=attrs.size)
+
+    async def listdir_attr(self, recursive=False):
+        """List the files in the last used remote directory.
+
+        :param bool recursive: also list the files in its subdirectories,
+            with their path relative to it (e.g. ``"output/1.txt"``)
+        :returns: a list of :data:`Attr`
+
+        """
+        results = []
+        directories = ['.']
+        while directories:
+            directory = directories.pop()
+            for name in await self._sftp.readdir(directory):
+                if name.filename in ('.', '..'):
+                    continue
+
+                path = posixpath.normpath(
+                    posixpath.join(directory, name.filename))
+                mode = name.attrs.permissions or 0
+                if stat.S_ISDIR(mode):
+                    if recursive:
+                        directories.append(path)
+                    continue
+
+                if recursive and not stat.S_ISREG(mode):
+                    continue
+
+                results.append(Attr(filename=path,
+                                    st_mtime=name.attrs.mtime,
+                                    st_size=name.attrs.size))
+
+        return results
+
+    async def download(self, filename, f, chunk_size=None):
+        """Copy a file from the last used remote directory.
+
+        :param str filename: the name of the file
+        :param f: the local binary file to write to
+        :param int chunk_size: the number of bytes to copy at a time
+        :returns: the number of bytes copied
+
+        """
+        chunk_size = chunk_size or DEFAULT_BUFFER_SIZE
+        remote_file = await self.open(filename, 'rb')
+        try:
+            return await _copy(remote_file.read, f, chunk_size)
+        finally:
+            await remote_file.close()
+
+    async def exec_command(self, args, workdir, timeout=None,
+                           stdout_handler=None, stderr_handler=None,
+                           buffer_size=None, line_buffered=False,
+                           tick_handler=None, tick_interval=None):
+        """Execute a command on the remote server.
+
+        This works like ``RemoteWrapper.exec_command``, except that the
+        handlers can also be coroutine functions, which are awaited.
+
+        :param list(str) args: the command and arguments to run
+        :param str workdir: the directory to run the commands from
+        :param datetime.timedelta timeout: the timeout to use for the command
+        :param stdout_handler: a function that accepts ``now`` and ``output``
+            parameters and is called when new output appears on stdout.
+        :param stderr_handler: a function that accepts ``now`` and ``output``
+            parameters and is called when new output appears on stderr.
+        :param int buffer_size: the number of bytes to read from each stream
+            at a time (see :class:`.stream.StreamReader`)
+        :param bool line_buffered: only pass whole lines to the handlers
+        :param tick_handler: a function that accepts a ``now`` parameter and
+            is called every ``tick_interval`` seconds while the command runs
+        :param float tick_interval: the time (in seconds) between two calls to
+            ``tick_handler``
+        :returns: whether the command succeeded
+
+        """
+        chdir = self._make_command(['cd', workdir], None)
+        run = self._make_command(args, timeout)
+        command = '{} && {}'.format(chdir, run)
+        logger.info('exec_command(command={!r})'.format(command))
+
+        process = await self._connection.create_process(command,
+                                                        encoding=None)
+
+        async def wait():
+            await process.wait()
+            return process.exit_status
+
+        try:
+            status = await _supervise(
+                process.stdout, process.stderr, wait,
+                stdout_handler, stderr_handler, buffer_size, line_buffered,
+                tick_handler, tick_interval,
+            )
+        finally:
+            if process.exit_status is None:
+                process.terminate()
+            process.close()
+
+        return status == 0
+
+    _make_command = RemoteWrapper._make_command
+
+
+class AsyncLocalWrapper(AsyncRemoteWrapper):
+    """
+    This class extends and modifies the functionality of the
+    ``AsyncRemoteWrapper``, to run the commands on the local machine with
+    :mod:`asyncio` subprocesses instead of over SSH.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncLocalWrapper, self).__init__(*args, **kwargs)
+        self.workdir = os.getcwd()
+        self._home = self.workdir
+
+    async def connect(self, *args, **kwargs):
+        return self
+
+    async def close(self, *args, **kwargs):
+        pass
+
+    async def chdir(self, remote_directory):
+        self.workdir = os.path.join(self.workdir, remote_directory)
+        try:
+            os.makedirs(self.workdir)
+        except OSError:
+            # In case the directory exists
+            pass
+
+    async def open(self, filename, mode):
+        return _AsyncFile(open(os.path.join(self.workdir, filename), mode))
+
+    async def stat(self, filename):
+        attrs = os.stat(os.path.join(self.workdir, filename))
+        return Attr(filename=filename, st_mtime=attrs.st_mtime,
+                    st_size=attrs.st_size)
+
+    async def listdir_attr(self, recursive=False):
+        results = []
+        for dirpath, dirnames, filenames in os.walk(self.workdir):
+            relpath = os.path.relpath(dirpath, self.workdir)
+            for filename in filenames:
+                path = os.path.normpath(os.path.join(relpath, filename))
+                attrs = os.stat(os.path.join(self.workdir, path))
+                results.append(Attr(filename=path.replace(os.sep, '/'),
+                                    st_mtime=attrs.st_mtime,
+                                    st_size=attrs.st_size))
+
+            if not recursive:
+                break
+
+        return results
+
+    async def exec_command(self, args, workdir, timeout=None,
+                           stdout_handler=None, stderr_handler=None,
+                           buffer_size=None, line_buffered=False,
+                           tick_handler=None, tick_interval=None):
+        if timeout is not None:
+            args = ['timeout', '{}s'.format(timeout.total_seconds())] + args
+
+        logger.info('{!r}'.format(args))
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=os.path.join(self._home, workdir)
+        )
+
+        try:
+            status = await _supervise(
+                process.stdout, process.stderr, process.wait,
+                stdout_handler, stderr_handler, buffer_size, line_buffered,
+                tick_handler, tick_interval,
+            )
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        return status == 0
+
+
+class _AsyncFile(object):
+    """A local file with the coroutine methods of an asyncssh file."""
+
+    def __init__(self, f):
+        self._file = f
+
+    async def read(self, size=-1):
+        return self._file.read(size)
+
+    async def write(self, data):
+        return self._file.write(data)
+
+    async def close(self):
+        self._file.close()
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+
+    return result
+
+
+async def _copy(read, f, chunk_size):
+    size = 0
+    while True:
+        data = await read(chunk_size)
+        if not data:
+            return size
+
+        f.write(data)
+        size += len(data)
+
+
+async def _pump(stream, handler, buffer_size, line_buffered):
+    """Pass the output of a stream on to its handler until it ends."""
+    emitted = []
+    reader = StreamReader(
+        None if handler is None else
+        lambda now, output: emitted.append((now, output)),
+        buffer_size,
+        line_buffered,
+    )
+
+    while True:
+        data = await stream.read(reader.buffer_size)
+        if data:
+            reader.feed(now(), data)
+        else:
+            reader.close(now())
+
+        for current_time, output in emitted:
+            await _maybe_await(handler(current_time, output))
+        del emitted[:]
+
+        if not data:
+            return
+
+
+async def _tick(tick_handler, tick_interval):
+    while True:
+        await asyncio.sleep(tick_interval)
+        await _maybe_await(tick_handler(now()))
+
+
+async def _supervise(stdout, stderr, wait, stdout_handler, stderr_handler,
+                     buffer_size, line_buffered, tick_handler,
+                     tick_interval):
+    """Pass on the output of a command while it runs.
+
+    :returns: the exit status of the command
+
+    """
+    ticker = None
+    if tick_handler is not None and tick_interval is not None:
+        ticker = asyncio.ensure_future(_tick(tick_handler, tick_interval))
+
+    try:
+        await asyncio.gather(
+            _pump(stdout, stdout_handler, buffer_size, line_buffered),
+            _pump(stderr, stderr_handler, buffer_size, line_buffered),
+        )
+        return await wait()
+    finally:
+        if ticker is not None:
+            ticker.cancel()
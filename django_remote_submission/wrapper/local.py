@@ -6,15 +6,20 @@ which works with the local file system, so that tests can be run on
 continuous integration servers.
 '''
 
+import collections
+import contextlib
+import hashlib
 import logging
 import os
 import os.path
+import selectors
 from collections import namedtuple
 from subprocess import PIPE, Popen
 
 from django.utils.timezone import now
 
 from .remote import RemoteWrapper
+from .stream import StreamReader
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +33,7 @@ class LocalWrapper(RemoteWrapper):
     def __init__(self, *args, **kwargs):
         super(LocalWrapper, self).__init__(*args, **kwargs)
         self.workdir = os.getcwd()
+        self._home = self.workdir
 
     def connect(self, *args, **kwargs):
         return self
@@ -44,6 +50,9 @@ class LocalWrapper(RemoteWrapper):
     def chdir(self, remote_directory):
         self.workdir = os.path.join(self.workdir, remote_directory)
 
+    def reset_directory(self):
+        self.workdir = self._home
+
     def open(self, filename, mode):
         # create the directory + subdirectories in case they don't exist
         try:
@@ -53,46 +62,155 @@ class LocalWrapper(RemoteWrapper):
             pass
         return open(os.path.join(self.workdir, filename), mode)
 
-    def listdir_attr(self):
-        Attr = namedtuple('Attr', ['filename', 'st_mtime'])
+    @contextlib.contextmanager
+    def _file_reader(self):
+        def open_file(attr):
+            return open(os.path.join(self.workdir, attr.filename), 'rb')
+
+        yield open_file
+
+    def stat(self, filename):
+        return os.stat(os.path.join(self.workdir, filename))
+
+    def listdir_attr(self, recursive=False):
+        Attr = namedtuple('Attr', ['filename', 'st_mtime', 'st_size'])
+
+        if recursive:
+            filenames = []
+            for dirpath, dirnames, files in os.walk(self.workdir):
+                relpath = os.path.relpath(dirpath, self.workdir)
+                for filename in files:
+                    filenames.append(os.path.normpath(
+                        os.path.join(relpath, filename)))
+        else:
+            filenames = os.listdir(self.workdir)
 
         results = []
-        for filename in os.listdir(self.workdir):
-            stat = os.stat(os.path.join(self.workdir, filename))
+        for filename in filenames:
+            path = os.path.join(self.workdir, filename)
+            if recursive and not os.path.isfile(path):
+                continue
+
+            stat = os.stat(path)
 
             results.append(Attr(
-                filename=filename,
+                filename=filename.replace(os.sep, '/'),
                 st_mtime=stat.st_mtime,
+                st_size=stat.st_size,
             ))
 
         return results
 
-    def exec_command(self, args, workdir, timeout=None, stdout_handler=None,
-                     stderr_handler=None):
+    def find_attr(self, newer_than=None, patterns=None, recursive=False):
+        # Listing the local directory is cheap, so leave all the filtering
+        # to the caller.
+        return self.listdir_attr(recursive)
+
+    def checksums(self, filenames):
+        digests = {}
+        for filename in filenames:
+            digest = hashlib.sha256()
+            try:
+                with open(os.path.join(self.workdir, filename), 'rb') as f:
+                    for chunk in iter(lambda: f.read(65536), b''):
+                        digest.update(chunk)
+            except (IOError, OSError):
+                continue
+
+            digests[filename] = digest.hexdigest()
+
+        return digests
+
+    def exec_commands(self, commands, buffer_size=None, line_buffered=False,
+                      max_parallel=None, tick_interval=None):
         '''
-        Altouhgh Log.LIVE is possible, the Local does not support True Live Log.
-        In local for large outputs, it looks like stdXXX_handle takes too long
-        and the buffer of the process over runs and the log gets truncated
+        The commands are run as local processes. As with the
+        ``RemoteWrapper``, a single loop waits on the pipes of all of them,
+        and passes their output on to the handlers as soon as it is read,
+        so the logs are live and only ``buffer_size`` bytes of output are
+        held at a time.
         '''
-        if timeout is not None:
-            args = ['timeout', '{}s'.format(timeout.total_seconds())] + args
+        select_timeout = self.select_timeout
+        if tick_interval is not None:
+            select_timeout = min(select_timeout, tick_interval)
 
-        logger.info('{!r}'.format(args))
-        process = Popen(args, stdout=PIPE, stderr=PIPE,
-                        cwd=self.workdir, universal_newlines=True)
+        waiting = collections.deque(enumerate(commands))
+        statuses = [None] * len(commands)
+        running = []
+        selector = selectors.DefaultSelector()
 
-        stdout, stderr = process.communicate()
+        try:
+            while waiting or running:
+                while waiting and (max_parallel is None or
+                                   len(running) < max_parallel):
+                    index, command = waiting.popleft()
+                    process = self._start_process(
+                        index, buffer_size, line_buffered, **command
+                    )
+                    running.append(process)
+                    selector.register(process.popen.stdout,
+                                      selectors.EVENT_READ, process.stdout)
+                    selector.register(process.popen.stderr,
+                                      selectors.EVENT_READ, process.stderr)
+
+                events = selector.select(select_timeout)
 
-        for line in stdout.split('\n'):
-            if line.strip():
-                current_time = now()
-                stdout_handler(current_time, line+'\n')
-        
-        for line in stderr.split('\n'):
-            if line.strip():
                 current_time = now()
-                stderr_handler(current_time, line+'\n')
-
-        logger.debug('Done reading the process stdout / stderr')
+                for key, _ in events:
+                    reader = key.data
+                    data = os.read(key.fd, reader.buffer_size)
+                    if data:
+                        reader.feed(current_time, data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        reader.close(current_time)
+
+                for process in list(running):
+                    if (process.popen.stdout.closed and
+                            process.popen.stderr.closed):
+                        running.remove(process)
+                        statuses[process.index] = process.popen.wait() == 0
+                    elif process.tick_handler is not None:
+                        process.tick_handler(current_time)
+
+            logger.debug('Done reading the processes stdout / stderr')
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+
+            for process in running:
+                process.popen.kill()
+                process.popen.wait()
+
+        return statuses
+
+    def _start_process(self, index, buffer_size, line_buffered, args,
+                       workdir, timeout=None, stdout_handler=None,
+                       stderr_handler=None, tick_handler=None):
+        if timeout is not None:
+            args = ['timeout', '{}s'.format(timeout.total_seconds())] + args
 
-        return process.returncode == 0
+        logger.info('{!r}'.format(args))
+        popen = Popen(args, stdout=PIPE, stderr=PIPE, bufsize=0,
+                      cwd=os.path.join(self._home, workdir))
+
+        return _Process(
+            index=index,
+            popen=popen,
+            stdout=StreamReader(stdout_handler, buffer_size, line_buffered),
+            stderr=StreamReader(stderr_handler, buffer_size, line_buffered),
+            tick_handler=tick_handler,
+        )
+
+
+class _Process(object):
+    """A command running as a local process, with readers for its output."""
+
+    def __init__(self, index, popen, stdout, stderr, tick_handler=None):
+        self.index = index
+        self.popen = popen
+        self.stdout = stdout
+        self.stderr = stderr
+        self.tick_handler = tick_handler
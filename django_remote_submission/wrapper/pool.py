@@ -0,0 +1,259 @@
+"""Keep authenticated SSH connections open between jobs.
+
+Setting up a connection (TCP, SSH handshake, authentication and SFTP) often
+costs more than running a short job. :class:`ConnectionPool` keeps the
+Paramiko client and SFTP session of a finished :class:`.RemoteWrapper` so
+the next wrapper for the same ``(hostname, port, username)`` can borrow them.
+
+Connections are only shared between wrappers that authenticated with the
+same credentials, and the pool forgets every connection it inherited when the
+process forks (e.g. in a Celery prefork worker).
+
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def make_credential(password=None, public_key_filename=None):
+    """Produce a digest identifying the credentials used for a connection.
+
+    :param str password: the password used to connect
+    :param str public_key_filename: the file containing the public key
+
+    """
+    value = '{!r}:{!r}'.format(password, public_key_filename)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class PooledConnection(object):
+    """A Paramiko client and SFTP session owned by a :class:`ConnectionPool`.
+
+    """
+
+    def __init__(self, key, credential, client, sftp):
+        """Instantiate a pooled connection.
+
+        :param tuple key: the ``(hostname, port, username)`` of the connection
+        :param str credential: the digest from :func:`make_credential`
+        :param paramiko.client.SSHClient client: the connected client
+        :param paramiko.sftp_client.SFTPClient sftp: the client's SFTP session
+
+        """
+        self.key = key
+        """The ``(hostname, port, username)`` this connection goes to."""
+
+        self.credential = credential
+        """The digest of the credentials used to authenticate."""
+
+        self.client = client
+        """The Paramiko Client instance"""
+
+        self.sftp = sftp
+        """The Paramiko SFTP instance"""
+
+        self.reusable = True
+        """Whether the connection may go back to the pool once released."""
+
+        self.last_used = time.time()
+        """When the connection was last handed back to the pool."""
+
+    def is_healthy(self):
+        """Check that the transport and the SFTP session are still usable."""
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        if self.sftp.get_channel().closed:
+            return False
+
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+
+        return True
+
+    def close(self):
+        """Close the SFTP session and the client."""
+        try:
+            self.sftp.close()
+            self.client.close()
+        except Exception:
+            logger.debug('Error closing pooled connection to %s',
+                         self.key, exc_info=True)
+
+
+class ConnectionPool(object):
+    """A process-level pool of authenticated SSH connections.
+
+    >>> from django_remote_submission.wrapper.pool import ConnectionPool
+    >>> pool = ConnectionPool(max_per_host=2, idle_timeout=60)
+    >>> pool.max_per_host
+    2
+
+    """
+
+    def __init__(self, max_per_host=4, idle_timeout=300, wait_timeout=60):
+        """Instantiate a connection pool.
+
+        :param int max_per_host: the most connections (borrowed or idle) to
+            keep open to any ``(hostname, port, username)``
+        :param float idle_timeout: the number of seconds after which an idle
+            connection is closed
+        :param float wait_timeout: the number of seconds to wait for a
+            connection to be released when ``max_per_host`` is reached
+
+        """
+        self.max_per_host = max_per_host
+        """The most connections to keep open to a single host and user."""
+
+        self.idle_timeout = idle_timeout
+        """The number of seconds an idle connection is kept open."""
+
+        self.wait_timeout = wait_timeout
+        """The number of seconds to wait for a free connection slot."""
+
+        self._condition = threading.Condition()
+        """Guards the attributes below and signals released connections."""
+
+        self._idle = collections.defaultdict(list)
+        """The idle connections for each key, oldest first."""
+
+        self._count = collections.Counter()
+        """The number of open connections (borrowed or idle) for each key."""
+
+        self._pid = os.getpid()
+        """The process that opened the connections in this pool."""
+
+    def acquire(self, key, credential, connect):
+        """Borrow a connection, or open a new one with ``connect``.
+
+        :param tuple key: the ``(hostname, port, username)`` to connect to
+        :param str credential: the digest from :func:`make_credential`
+        :param connect: a function returning a new ``(client, sftp)`` pair
+
+        """
+        deadline = time.time() + self.wait_timeout
+
+        while True:
+            with self._condition:
+                self._check_pid()
+                self._evict_idle()
+
+                connection = self._take_idle(key, credential)
+                if connection is None:
+                    if self._count[key] < self.max_per_host:
+                        self._count[key] += 1
+                        break
+
+                    if self._idle[key]:
+                        # Make room by closing a connection that was opened
+                        # with other credentials.
+                        self._discard(self._idle[key].pop(0))
+                        continue
+
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError(
+                            'Timed out waiting for a connection to '
+                            '{}@{}:{}'.format(key[2], key[0], key[1]))
+
+                    self._condition.wait(remaining)
+                    continue
+
+            if connection.is_healthy():
+                logger.debug('Reusing pooled connection to %s', key)
+                return connection
+
+            with self._condition:
+                self._discard(connection)
+
+        try:
+            client, sftp = connect()
+        except Exception:
+            with self._condition:
+                self._count[key] -= 1
+                self._condition.notify()
+            raise
+
+        return PooledConnection(key, credential, client, sftp)
+
+    def release(self, connection):
+        """Hand a borrowed connection back to the pool.
+
+        :param PooledConnection connection: the connection to release
+
+        """
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+
+            if connection.reusable and connection.is_healthy():
+                connection.sftp.chdir(None)
+                connection.last_used = time.time()
+                self._idle[connection.key].append(connection)
+                self._condition.notify()
+            else:
+                self._discard(connection)
+
+            self._evict_idle()
+
+    def discard(self, key):
+        """Close every idle connection to the given key.
+
+        :param tuple key: the ``(hostname, port, username)`` to forget
+
+        """
+        with self._condition:
+            while self._idle[key]:
+                self._discard(self._idle[key].pop())
+
+    def clear(self):
+        """Close every idle connection in the pool."""
+        with self._condition:
+            for key in list(self._idle):
+                self.discard(key)
+
+    def _take_idle(self, key, credential):
+        idle = self._idle[key]
+        for connection in reversed(idle):
+            if connection.credential == credential:
+                idle.remove(connection)
+                return connection
+
+        return None
+
+    def _discard(self, connection):
+        connection.close()
+        self._count[connection.key] -= 1
+        self._condition.notify()
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        for key, idle in self._idle.items():
+            while idle and idle[0].last_used < cutoff:
+                logger.debug('Closing idle connection to %s', key)
+                self._discard(idle.pop(0))
+
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+
+        # The connections belong to the parent process; closing them here
+        # would tear down the parent's sessions, so just forget them.
+        self._idle.clear()
+        self._count.clear()
+        self._pid = os.getpid()
+
+
+connection_pool = ConnectionPool()
+"""The pool used by :class:`.RemoteWrapper` unless told otherwise."""
@@ -8,15 +8,23 @@ not available.
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+import contextlib
 import datetime
 import logging
 import os
+import posixpath
+import selectors
+import stat
+import sys
 import textwrap
+import threading
 import uuid
 
 import six
 from django.utils.timezone import now
-from paramiko import AuthenticationException, BadHostKeyException
+from paramiko import (AuthenticationException, BadHostKeyException,
+                      SFTPAttributes)
 from paramiko.client import AutoAddPolicy, SSHClient
 
 try:
@@ -24,6 +32,13 @@ try:
 except ImportError:
     from pipes import quote as cmd_quote
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .pool import connection_pool, make_credential
+from .stream import StreamReader
 
 logger = logging.getLogger(__name__)
 
@@ -33,17 +48,36 @@ class RemoteWrapper(object):
     Wrapper around Paramiko which simplifies the remote connection API.
     """
 
-    def __init__(self, hostname, username, port=22):
+    select_timeout = 1.0
+    """The longest time (in seconds) to block waiting for channel activity.
+
+    Paramiko wakes the channel's file descriptor whenever stdout or stderr
+    data arrives and when the channel is closed, so this is only an upper
+    bound for noticing an exit status that arrives on its own.
+    """
+
+    read_window = 4 * 1024 * 1024
+    """The most bytes of a file :meth:`read_files` requests ahead of the
+    reader, which bounds the memory used for each file being read.
+    """
+
+    checksum_batch_size = 500
+    """The most files :meth:`checksums` passes to a single command."""
+
+    def __init__(self, hostname, username, port=22, use_pool=True):
         """Initialize the wrapper.
 
         :param str hostname: the hostname of the server to connect to
         :param str username: the username of the user on the remote server
         :param int port: the SSH port to connect to
+        :param bool use_pool: borrow the connection from (and return it to)
+            :data:`.pool.connection_pool` instead of opening a new one
 
         """
         self.hostname = hostname
         self.username = username
         self.port = port
+        self.use_pool = use_pool
 
         self._client = None
         """The Paramiko Client instance"""
@@ -51,6 +85,9 @@ class RemoteWrapper(object):
         self._sftp = None
         """The Paramiko SFTP instance"""
 
+        self._connection = None
+        """The :class:`.pool.PooledConnection` borrowed from the pool"""
+
         self._public_key_filename = None
         """The Public key passed as parameter"""
 
@@ -79,18 +116,43 @@ class RemoteWrapper(object):
         #     public_key_filename = os.path.expanduser('~/.ssh/id_rsa.pub')
 
         self._public_key_filename = public_key_filename
-        self._client = self._start_client(password, public_key_filename)
-        self._sftp = self._client.open_sftp()
+
+        if not self.use_pool:
+            self._client = self._start_client(password, public_key_filename)
+            self._sftp = self._client.open_sftp()
+            return self
+
+        def start():
+            client = self._start_client(password, public_key_filename)
+            return client, client.open_sftp()
+
+        self._connection = connection_pool.acquire(
+            self._pool_key(),
+            make_credential(password, public_key_filename),
+            start,
+        )
+        self._client = self._connection.client
+        self._sftp = self._connection.sftp
         return self
 
     def close(self):
-        """Close any open connections and clear their attributes."""
-        self._sftp.close()
-        self._sftp = None
+        """Close any open connections and clear their attributes.
 
-        self._client.close()
+        A connection borrowed from the pool is handed back instead.
+        """
+        if self._connection is not None:
+            connection_pool.release(self._connection)
+            self._connection = None
+        else:
+            self._sftp.close()
+            self._client.close()
+
+        self._sftp = None
         self._client = None
 
+    def _pool_key(self):
+        return (self.hostname, self.port, self.username)
+
     def _mkdir_p(self, remote_directory):
         """Change to this directory, recursively making new folders if needed.
         Returns True if any folders were created.
@@ -125,6 +187,14 @@ class RemoteWrapper(object):
         self._mkdir_p(remote_directory)
         # self._sftp.chdir(remote_directory)
 
+    def reset_directory(self):
+        """Go back to the directory the connection started in (usually the
+        remote user's home directory), so relative paths given to
+        :meth:`chdir` are no longer relative to the last directory used.
+
+        """
+        self._sftp.chdir(None)
+
     def open(self, filename, mode):
         """Open a file from the last used remote directory.
 
@@ -135,19 +205,285 @@ class RemoteWrapper(object):
         """
         return self._sftp.open(filename, mode)
 
-    def listdir_attr(self):
+    def read_files(self, file_attrs, handler, workers=4):
+        """Read several files from the last used remote directory at once.
+
+        Each worker thread opens its own SFTP session on the connection and
+        requests up to :attr:`read_window` bytes ahead of what has been read,
+        so many read requests are in flight at the same time instead of one
+        per round trip. For example::
+
+            def store(attr, f):
+                storage.save(attr.filename, File(f))
+
+            wrapper.read_files(wrapper.listdir_attr(), store, workers=8)
+
+        If ``handler`` raises an exception, no new files are started and the
+        first exception is raised again once the workers are done.
+
+        :param list file_attrs: the attributes of the files to read, as
+            returned by :meth:`listdir_attr`
+        :param handler: a function that accepts ``attr`` and ``f`` parameters
+            and is called from a worker thread with each file opened for
+            reading in binary mode
+        :param int workers: the most files to read at the same time
+
+        """
+        tasks = queue.Queue()
+        for attr in file_attrs:
+            tasks.put(attr)
+
+        errors = []
+
+        def work():
+            try:
+                with self._file_reader() as open_file:
+                    while not errors:
+                        try:
+                            attr = tasks.get_nowait()
+                        except queue.Empty:
+                            return
+
+                        with open_file(attr) as f:
+                            handler(attr, f)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        threads = [
+            threading.Thread(target=work)
+            for _ in range(min(workers, len(file_attrs)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            six.reraise(*errors[0])
+
+    @contextlib.contextmanager
+    def _file_reader(self):
+        """Open a new SFTP session in the current directory and provide a
+        function that opens files for reading through it.
+
+        """
+        sftp = self._client.open_sftp()
+        try:
+            sftp.chdir(self._sftp.getcwd())
+
+            def open_file(attr):
+                f = sftp.open(attr.filename, 'rb')
+                return _PipelinedFile(f, attr.st_size, self.read_window)
+
+            yield open_file
+        finally:
+            sftp.close()
+
+    def stat(self, filename):
+        """Retrieve the attributes of a file in the last used remote directory.
+
+        The object has the same ``st_mtime`` attribute as the ones returned by
+        :meth:`listdir_attr`, measured with the remote server's clock.
+
+        :param str filename: the name of the file
+
+        """
+        return self._sftp.stat(filename)
+
+    def listdir_attr(self, recursive=False):
         """Retrieve a list of files and their attributes.
 
         Each object is guaranteed to have a ``filename`` attribute as well as
         an ``st_mtime`` attribute, which gives the last modified time in
-        seconds.
+        seconds, and an ``st_size`` attribute, which gives the size in bytes.
+
+        With ``recursive``, the regular files in every subdirectory are
+        listed too (but not the directories themselves), with a ``filename``
+        relative to the last used remote directory, such as
+        ``"output/1.txt"``. The whole tree is listed by a single ``find``
+        command on the server, or walked over SFTP if ``find`` does not
+        support ``-printf``.
+
+        :param bool recursive: list the files in subdirectories too
 
         """
-        return self._sftp.listdir_attr()
+        if not recursive:
+            return self._sftp.listdir_attr()
 
+        results = self._find([])
+        if results is None:
+            logger.debug('find -printf failed, walking the directory '
+                         'over SFTP instead')
+            results = list(self._walk_attr(''))
+
+        return results
+
+    def find_attr(self, newer_than=None, patterns=None, recursive=False):
+        """Retrieve the files that may have changed and match the patterns.
+
+        This is a faster :meth:`listdir_attr` for directories holding many
+        files: a single ``find`` command on the server only lists the
+        regular files modified since ``newer_than`` whose name matches one of
+        the positive ``patterns`` (see :func:`.harvest.is_matching`), so the
+        attributes of the other files are never transferred.
+
+        The list may still contain files that don't match: the cutoff is
+        rounded down to the second, and negative patterns are ignored. The
+        caller should filter the files again, and the same unfiltered list
+        as :meth:`listdir_attr` is returned if ``find`` is not usable.
+
+        :param float newer_than: the earliest modification time of the files
+        :param list(str) patterns: the patterns of the files to find, with
+            the same meaning as for :func:`.harvest.is_matching`
+        :param bool recursive: find the files in subdirectories too
+
+        """
+        if patterns is None:
+            patterns = ['*']
+
+        positive = [pattern for pattern in patterns
+                    if not pattern.startswith('!')]
+        if not positive:
+            return []
+
+        predicates = []
+        if not recursive:
+            predicates += ['-maxdepth', '1']
+
+        if newer_than is not None:
+            # -newermt is strict, so step back one second.
+            predicates += ['-newermt', '@{:d}'.format(int(newer_than) - 1)]
+
+        if '*' not in positive:
+            names = []
+            for pattern in positive:
+                names += ['-o', '-path', './' + pattern]
+            predicates += ['('] + names[1:] + [')']
+
+        results = self._find(predicates)
+        if results is None:
+            logger.debug('find -printf failed, listing the directory '
+                         'over SFTP instead')
+            results = self.listdir_attr(recursive)
+
+        return results
+
+    def _find(self, predicates):
+        """List the regular files below the last used remote directory that
+        satisfy the ``find`` predicates, or return ``None`` if ``find`` fails.
+
+        """
+        command = "find . -mindepth 1 {} -type f -printf '%P\\0%T@\\0%s\\0'"
+        status, output = self._run_in_cwd(command.format(
+            ' '.join(cmd_quote(arg) for arg in predicates)))
+        if status != 0:
+            return None
+
+        fields = output.split(b'\0')
+        results = []
+        for filename, mtime, size in zip(*[iter(fields)] * 3):
+            try:
+                filename = filename.decode('utf-8')
+            except UnicodeDecodeError:
+                logger.warning('Skipping %r: the name is not UTF-8', filename)
+                continue
+
+            attr = SFTPAttributes()
+            attr.filename = filename
+            attr.st_mtime = float(mtime)
+            attr.st_size = int(size)
+            results.append(attr)
+
+        return results
+
+    def _walk_attr(self, directory):
+        for attr in self._sftp.listdir_attr(directory or '.'):
+            attr.filename = posixpath.join(directory, attr.filename)
+            if stat.S_ISDIR(attr.st_mode or 0):
+                for child in self._walk_attr(attr.filename):
+                    yield child
+            elif stat.S_ISREG(attr.st_mode or 0):
+                yield attr
+
+    def _run_in_cwd(self, command):
+        """Run a short command in the last used remote directory.
+
+        Whatever the command writes to stderr (such as permission errors) is
+        read as it comes too, by the same loop as :meth:`exec_commands`, and
+        logged: left unread, it would fill the channel's window and the
+        command would never finish.
+
+        :param str command: the shell command to run
+        :returns: the exit status and the bytes written to stdout
+
+        """
+        cwd = self._sftp.getcwd()
+        if cwd is not None:
+            command = 'cd {} && {}'.format(cmd_quote(cwd), command)
+
+        channel = self._client.get_transport().open_session()
+        channel.exec_command(command)
+
+        # Latin-1 maps each byte to one character, so the output can be
+        # turned back into the exact bytes written by the command
+        output = []
+        session = _Session(
+            index=0,
+            channel=channel,
+            stdout=StreamReader(lambda time, text: output.append(text),
+                                encoding='latin-1'),
+            stderr=StreamReader(
+                lambda time, text: logger.debug('%s: %r', command, text)),
+        )
+
+        selector = selectors.DefaultSelector()
+        selector.register(channel, selectors.EVENT_READ)
+        try:
+            while not session.read(now()):
+                selector.select(self.select_timeout)
+        finally:
+            selector.close()
+            channel.close()
+
+        return channel.recv_exit_status(), ''.join(output).encode('latin-1')
+
+    def checksums(self, filenames):
+        """Compute the SHA-256 digests of files in the last used remote
+        directory.
+
+        The digests are computed on the remote server with ``sha256sum``, in
+        as few commands as possible, so the files do not have to be
+        transferred. Files that could not be read (or whose names
+        ``sha256sum`` has to escape) are left out.
+
+        :param list(str) filenames: the names of the files
+        :returns: a dict mapping each filename to its hexadecimal digest
+
+        """
+        digests = {}
+
+        for start in range(0, len(filenames), self.checksum_batch_size):
+            batch = filenames[start:start + self.checksum_batch_size]
+            status, output = self._run_in_cwd('sha256sum -- {}'.format(
+                ' '.join(cmd_quote(filename) for filename in batch)))
+            output = output.decode('utf-8', 'replace')
+
+            for line in output.splitlines():
+                # Lines for escaped filenames start with a backslash.
+                digest, sep, filename = line.partition(' ')
+                if not sep or digest.startswith('\\'):
+                    continue
+
+                filename = filename[1:]  # the ' ' or '*' mode marker
+                if filename in batch:
+                    digests[filename] = digest
+
+        return digests
 
     def exec_command(self, args, workdir, timeout=None, stdout_handler=None,
-                     stderr_handler=None):
+                     stderr_handler=None, buffer_size=None,
+                     line_buffered=False, tick_handler=None,
+                     tick_interval=None):
         """Execute a command on the remote server.
 
         An example of how to use this function::
@@ -168,37 +504,126 @@ class RemoteWrapper(object):
             parameters and is called when new output appears on stdout.
         :param stderr_handler: a function that accepts ``now`` and ``output``
             parameters and is called when new output appears on stderr.
+        :param int buffer_size: the number of bytes to read from each stream
+            at a time (see :class:`.stream.StreamReader`)
+        :param bool line_buffered: only pass whole lines to the handlers
+        :param tick_handler: a function that accepts a ``now`` parameter and
+            is called whenever the command's output is checked, even if there
+            was none, e.g. to flush output that has been held back for too
+            long
+        :param float tick_interval: the longest time (in seconds) between two
+            calls to ``tick_handler``
+
+        """
+        return self.exec_commands(
+            [dict(
+                args=args,
+                workdir=workdir,
+                timeout=timeout,
+                stdout_handler=stdout_handler,
+                stderr_handler=stderr_handler,
+                tick_handler=tick_handler,
+            )],
+            buffer_size=buffer_size,
+            line_buffered=line_buffered,
+            tick_interval=tick_interval,
+        )[0]
+
+    def exec_commands(self, commands, buffer_size=None, line_buffered=False,
+                      max_parallel=None, tick_interval=None):
+        """Execute several commands at once over the same connection.
+
+        Each command gets its own session channel on the one SSH transport,
+        and a single loop reads the output of all of them and passes it to
+        each command's own handlers. For example::
+
+            wrapper.exec_commands([
+                dict(args=['python', 'a.py'], workdir='/tmp/a',
+                     stdout_handler=logs_a.write_stdout),
+                dict(args=['python', 'b.py'], workdir='/tmp/b',
+                     stdout_handler=logs_b.write_stdout),
+            ], max_parallel=10)
+
+        :param list(dict) commands: the ``args``, ``workdir`` and optionally
+            ``timeout``, ``stdout_handler``, ``stderr_handler`` and
+            ``tick_handler`` of each command, as accepted by
+            :meth:`exec_command`
+        :param int buffer_size: the number of bytes to read from each stream
+            at a time (see :class:`.stream.StreamReader`)
+        :param bool line_buffered: only pass whole lines to the handlers
+        :param int max_parallel: the most commands to run at the same time,
+            e.g. to stay under the server's ``MaxSessions`` (by default all
+            the commands are started at once)
+        :param float tick_interval: the longest time (in seconds) between two
+            calls to each running command's ``tick_handler``
+        :returns: whether each command succeeded, in the order given
 
         """
+        select_timeout = self.select_timeout
+        if tick_interval is not None:
+            select_timeout = min(select_timeout, tick_interval)
+
+        transport = self._client.get_transport()
+        waiting = collections.deque(enumerate(commands))
+        statuses = [None] * len(commands)
+        selector = selectors.DefaultSelector()
+
+        try:
+            while waiting or selector.get_map():
+                while waiting and (max_parallel is None or
+                                   len(selector.get_map()) < max_parallel):
+                    index, command = waiting.popleft()
+                    session = self._start_session(
+                        transport, index, buffer_size, line_buffered,
+                        **command
+                    )
+                    selector.register(session.channel, selectors.EVENT_READ,
+                                      session)
+
+                # Sleep until there is output to read or a command exits
+                # instead of spinning on the ``*_ready()`` methods.
+                events = selector.select(select_timeout)
+                if events:
+                    sessions = [key.data for key, _ in events]
+                else:
+                    sessions = [key.data
+                                for key in selector.get_map().values()]
+
+                current_time = now()
+                for session in sessions:
+                    if session.read(current_time):
+                        selector.unregister(session.channel)
+                        session.channel.close()
+                        statuses[session.index] = session.succeeded()
+
+                for key in selector.get_map().values():
+                    if key.data.tick_handler is not None:
+                        key.data.tick_handler(current_time)
+        finally:
+            for key in list(selector.get_map().values()):
+                key.data.channel.close()
+            selector.close()
+
+        return statuses
+
+    def _start_session(self, transport, index, buffer_size, line_buffered,
+                       args, workdir, timeout=None, stdout_handler=None,
+                       stderr_handler=None, tick_handler=None):
         chdir = self._make_command(['cd', workdir], None)
         run = self._make_command(args, timeout)
         command = '{} && {}'.format(chdir, run)
         logger.info('exec_command(command={!r})'.format(command))
 
-        transport = self._client.get_transport()
         channel = transport.open_session()
-
         channel.exec_command(command)
-        while True:
-            current_time = now()
-            if channel.recv_ready():
-                output = channel.recv(1024).decode('utf-8')
-                if stdout_handler is not None:
-                    stdout_handler(current_time, output)
-
-            if channel.recv_stderr_ready():
-                output = channel.recv_stderr(1024).decode('utf-8')
-                if stderr_handler is not None:
-                    stderr_handler(current_time, output)
-
-            if channel.exit_status_ready():
-                if channel.recv_ready() or channel.recv_stderr_ready():
-                    continue
 
-                if channel.recv_exit_status() == 0:
-                    return True
-                else:
-                    return False
+        return _Session(
+            index=index,
+            channel=channel,
+            stdout=StreamReader(stdout_handler, buffer_size, line_buffered),
+            stderr=StreamReader(stderr_handler, buffer_size, line_buffered),
+            tick_handler=tick_handler,
+        )
 
     def _start_client(self, password, public_key_filename):
         '''
@@ -324,7 +749,7 @@ class RemoteWrapper(object):
         with self.open(filename, 'wt') as f:
             program = textwrap.dedent('''\
             sed -i.bak -e /{key}/d $HOME/.ssh/authorized_keys
-            '''.format(key=cmd_quote(key.replace('/', '\/'))))
+            '''.format(key=cmd_quote(key.replace('/', '\\/'))))
 
             f.write(program)
 
@@ -333,3 +758,117 @@ class RemoteWrapper(object):
         ]
 
         self.exec_command(args, '/')
+
+        # Connections authenticated with the deleted key must not be reused.
+        if self._connection is not None:
+            self._connection.reusable = False
+            connection_pool.discard(self._pool_key())
+
+
+class _Session(object):
+    """A command running on its own channel, with readers for its output."""
+
+    def __init__(self, index, channel, stdout, stderr, tick_handler=None):
+        self.index = index
+        self.channel = channel
+        self.stdout = stdout
+        self.stderr = stderr
+        self.tick_handler = tick_handler
+
+    def read(self, current_time):
+        """Read whatever output is available and return ``True`` once the
+        command has exited and all of its output has been read.
+
+        """
+        channel = self.channel
+
+        if channel.recv_ready():
+            self.stdout.feed(current_time, channel.recv(self.stdout.buffer_size))
+
+        if channel.recv_stderr_ready():
+            self.stderr.feed(current_time,
+                             channel.recv_stderr(self.stderr.buffer_size))
+
+        if not channel.exit_status_ready():
+            return False
+
+        if channel.recv_ready() or channel.recv_stderr_ready():
+            return False
+
+        self.stdout.close(current_time)
+        self.stderr.close(current_time)
+        return True
+
+    def succeeded(self):
+        return self.channel.recv_exit_status() == 0
+
+
+class _PipelinedFile(object):
+    """Read a remote file from start to end with requests sent ahead.
+
+    Paramiko's ``prefetch()`` would hold the whole file in memory if it
+    arrives faster than it is read, so the file is requested one window at
+    a time instead.
+
+    """
+
+    def __init__(self, f, size, window):
+        self.file = f
+        self.size = size
+        self.window = window
+
+        self._offset = 0
+        """The offset of the first byte not requested yet."""
+
+        self._chunks = iter(())
+        """The chunks requested for the current window."""
+
+        self._buffer = b''
+        """The part of the last chunk that has not been read yet."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while remaining != 0:
+            if not self._buffer:
+                self._buffer = self._next_chunk()
+                if not self._buffer:
+                    break
+
+            if remaining < 0:
+                part, self._buffer = self._buffer, b''
+            else:
+                part = self._buffer[:remaining]
+                self._buffer = self._buffer[remaining:]
+                remaining -= len(part)
+
+            parts.append(part)
+
+        return b''.join(parts)
+
+    def _next_chunk(self):
+        for chunk in self._chunks:
+            if chunk:
+                return chunk
+
+        if self._offset >= self.size:
+            return b''
+
+        start = self._offset
+        end = min(self.size, start + self.window)
+        step = self.file.MAX_REQUEST_SIZE
+        self._chunks = self.file.readv([
+            (offset, min(step, end - offset))
+            for offset in range(start, end, step)
+        ])
+        self._offset = end
+        return self._next_chunk()
@@ -0,0 +1,107 @@
+"""Turn the raw bytes coming out of a running job into text for the handlers.
+
+A channel hands over its output in arbitrary slices, which can cut through
+the middle of a multi-byte character or of a line. :class:`StreamReader`
+decodes the slices incrementally and, optionally, only passes whole lines on
+to the handler.
+
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import codecs
+
+DEFAULT_BUFFER_SIZE = 32768
+"""The default number of bytes to read from a job's output at a time."""
+
+
+class StreamReader(object):
+    """Decode the output of one stream and pass it on to a handler.
+
+    >>> from django_remote_submission.wrapper.stream import StreamReader
+    >>> reader = StreamReader(lambda now, output: print(repr(output)),
+    ...                       line_buffered=True)
+    >>> reader.feed(None, b'caf\\xc3')
+    >>> reader.feed(None, b'\\xa9\\nhello')
+    'café\\n'
+    >>> reader.close(None)
+    'hello'
+
+    """
+
+    def __init__(self, handler, buffer_size=None, line_buffered=False,
+                 encoding='utf-8'):
+        """Instantiate a stream reader.
+
+        :param handler: a function that accepts ``now`` and ``output``
+            parameters, or ``None`` to discard the stream
+        :param int buffer_size: the number of bytes to read at a time, and
+            the most text to hold back while waiting for the end of a line
+        :param bool line_buffered: only pass whole lines to the handler
+        :param str encoding: the encoding of the stream
+
+        """
+        if buffer_size is None:
+            buffer_size = DEFAULT_BUFFER_SIZE
+
+        self.handler = handler
+        """The function called with the decoded output."""
+
+        self.buffer_size = buffer_size
+        """The number of bytes to read from the stream at a time."""
+
+        self.line_buffered = line_buffered
+        """Whether to hold back output until a line is complete."""
+
+        self._decoder = codecs.getincrementaldecoder(encoding)(
+            errors='replace',
+        )
+        """The decoder keeping partial characters between chunks."""
+
+        self._pending = ''
+        """Decoded text that is waiting for the end of its line."""
+
+    def feed(self, now, data):
+        """Decode a chunk of output and pass on whatever is complete.
+
+        :param datetime.datetime now: the time this chunk was read
+        :param bytes data: the raw chunk of output
+
+        """
+        if self.handler is None:
+            return
+
+        text = self._decoder.decode(data)
+
+        if not self.line_buffered:
+            self._emit(now, text)
+            return
+
+        self._pending += text
+
+        end = self._pending.rfind('\n') + 1
+        if end == 0:
+            if len(self._pending) < self.buffer_size:
+                return
+
+            end = len(self._pending)
+
+        output, self._pending = self._pending[:end], self._pending[end:]
+        self._emit(now, output)
+
+    def close(self, now):
+        """Pass on anything still held back once the stream has ended.
+
+        :param datetime.datetime now: the time the stream ended
+
+        """
+        if self.handler is None:
+            return
+
+        output = self._pending + self._decoder.decode(b'', final=True)
+        self._pending = ''
+        self._emit(now, output)
+
+    def _emit(self, now, output):
+        if output:
+            self.handler(now, output)
@@ -60,6 +60,10 @@ setup(
         # Filter for DRF
         'django-filter>=1.1.0',
     ],
+    extras_require={
+        # Supervise jobs on remote servers from an asyncio event loop
+        'async': ['asyncssh>=1.16.0'],
+    },
     # install_requires=reqs,
     license="ISCL",
     zip_safe=False,
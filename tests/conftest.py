@@ -1,6 +1,46 @@
+import collections
+
+import pytest
 from django.conf import settings
 
 
+EnvBase = collections.namedtuple('Env', [
+    'server_hostname', 'server_port', 'remote_directory', 'remote_filename',
+    'remote_user', 'remote_password', 'python_path', 'python_arguments',
+])
+
+
+class Env(EnvBase):
+    def __repr__(self):
+        return super(Env, self).__repr__().replace(
+            'remote_password={!r}'.format(self.remote_password),
+            'remote_password={!r}'.format('******'),
+        )
+
+
+@pytest.fixture
+def env():
+    import environ
+
+    path = environ.Path(__file__) - 2
+    env = environ.Env()
+    environ.Env.read_env(path('.env'))
+
+    try:
+        return Env(
+            server_hostname=env('TEST_SERVER_HOSTNAME'),
+            server_port=env.int('TEST_SERVER_PORT'),
+            remote_directory=env('TEST_REMOTE_DIRECTORY'),
+            remote_filename=env('TEST_REMOTE_FILENAME'),
+            remote_user=env('TEST_REMOTE_USER'),
+            remote_password=env('TEST_REMOTE_PASSWORD'),
+            python_path=env('TEST_PYTHON_PATH'),
+            python_arguments=env.list('TEST_PYTHON_ARGUMENTS'),
+        )
+    except Exception as e:
+        pytest.skip('Environment variables not set: {!r}'.format(e))
+
+
 def pytest_addoption(parser):
     parser.addoption(
         '--ci', action='store_true',
@@ -72,6 +112,15 @@ def pytest_configure():
         CELERY_EAGER_PROPAGATES_EXCEPTIONS=True,
     )
 
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmpdir):
+    """Keep the files stored by each test (results, log blobs and log files)
+    out of the repository, in a temporary ``MEDIA_ROOT``."""
+    settings.MEDIA_ROOT = str(tmpdir.mkdir('media'))
+    return settings.MEDIA_ROOT
+
+
 # This is to configure celery: NOT in use
 # import pytest
 # from example.server.celery import app
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-remote-submission
+------------
+
+Tests for `django-remote-submission` broadcast module.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def receive():
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    channel_name = async_to_sync(channel_layer.new_channel)()
+    async_to_sync(channel_layer.group_add)('group', channel_name)
+
+    def receive():
+        return async_to_sync(channel_layer.receive)(channel_name)['text']
+
+    return receive
+
+
+@pytest.mark.django_db(transaction=True)
+def test_broadcaster_batches(receive):
+    from django_remote_submission.broadcast import Broadcaster
+
+    broadcaster = Broadcaster(flush_interval=60)
+    broadcaster.send('group', 'first')
+    assert receive() == ['first']
+
+    broadcaster.send('group', {'job_id': 1, 'status': 'submitted'}, key=1)
+    broadcaster.send('group', {'job_id': 2, 'status': 'submitted'}, key=2)
+    broadcaster.send('group', 'second')
+    broadcaster.send('group', {'job_id': 1, 'status': 'success'}, key=1)
+    broadcaster.flush()
+
+    assert receive() == [
+        {'job_id': 2, 'status': 'submitted'},
+        'second',
+        {'job_id': 1, 'status': 'success'},
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_broadcaster_on_commit(receive):
+    from django.db import transaction
+    from django_remote_submission.broadcast import Broadcaster
+
+    broadcaster = Broadcaster(flush_interval=0)
+
+    try:
+        with transaction.atomic():
+            broadcaster.send('group', 'rolled back')
+            raise ValueError()
+    except ValueError:
+        pass
+
+    with transaction.atomic():
+        broadcaster.send_many([('group', 'first', None),
+                               ('group', 'second', None)])
+        assert not broadcaster._groups
+
+    assert receive() == ['first', 'second']
+
+
+def test_broadcaster_flush_order(mocker):
+    import threading
+    import time
+    from django_remote_submission.broadcast import Broadcaster
+
+    sent = []
+    sending = threading.Event()
+
+    def group_send(group, message):
+        if not sending.is_set():
+            sending.set()
+            time.sleep(0.2)
+        sent.append(message['text'])
+
+    mocker.patch('channels.layers.get_channel_layer')
+    mocker.patch('django_remote_submission.broadcast.async_to_sync',
+                 return_value=group_send)
+
+    broadcaster = Broadcaster(flush_interval=60)
+    broadcaster._last_flush = time.time()
+    broadcaster._queue([('group', 'first', None)])
+
+    thread = threading.Thread(target=broadcaster.flush)
+    thread.start()
+    sending.wait()
+    broadcaster._queue([('group', 'second', None)])
+    broadcaster.flush()
+    thread.join()
+
+    assert sent == [['first'], ['second']]
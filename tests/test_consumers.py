@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-remote-submission
+------------
+
+Tests for `django-remote-submission` consumers module.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def job():
+    from django_remote_submission.models import Interpreter, Job, Server
+    from django.contrib.auth import get_user_model
+
+    return Job.objects.create(
+        title='1-job-title',
+        program='1-job-program',
+        remote_directory='1-job-remote_directory',
+        remote_filename='1-job-remote_filename',
+        server=Server.objects.create(
+            title='1-server-title',
+            hostname='1-server-hostname.invalid',
+        ),
+        owner=get_user_model().objects.create(username='1-user-username'),
+        interpreter=Interpreter.objects.create(
+            name='1-interpreter-name',
+            path='1-interpreter-path',
+        ),
+    )
+
+
+@pytest.fixture
+def log_communicator():
+    from channels.testing import WebsocketCommunicator
+    from django_remote_submission.consumers import JobLogConsumer
+
+    def log_communicator(job, query_string=''):
+        communicator = WebsocketCommunicator(
+            JobLogConsumer.as_asgi(),
+            '/ws/job-log/{}/?{}'.format(job.pk, query_string))
+        communicator.scope['url_route'] = {'kwargs': {'job_pk': job.pk}}
+        return communicator
+
+    return log_communicator
+
+
+@pytest.mark.django_db(transaction=True)
+def test_job_log_consumer_replay(job, log_communicator, monkeypatch):
+    from asgiref.sync import async_to_sync
+    from django_remote_submission.broadcast import broadcaster
+    from django_remote_submission.consumers import JobLogConsumer
+    from django_remote_submission.models import Log
+
+    monkeypatch.setattr(JobLogConsumer, 'log_page_size', 2)
+
+    Log.objects.bulk_ingest([
+        Log(content='{}'.format(i), job=job) for i in range(5)
+    ])
+    broadcaster.flush()
+
+    async def replay():
+        viewer = log_communicator(job)
+        connected, _ = await viewer.connect()
+        assert connected
+
+        frames = [await viewer.receive_json_from() for i in range(3)]
+
+        other = log_communicator(job)
+        await other.connect()
+        other_frames = [await other.receive_json_from()
+                        for i in range(3)]
+        assert await viewer.receive_nothing()
+
+        await viewer.disconnect()
+        await other.disconnect()
+        return frames, other_frames
+
+    frames, other_frames = async_to_sync(replay)()
+
+    assert [[m['content'] for m in frame] for frame in frames] == [
+        ['0', '1'], ['2', '3'], ['4']]
+    assert other_frames == frames
+
+
+@pytest.mark.django_db(transaction=True)
+def test_job_log_consumer_replay_content_size(job, log_communicator,
+                                              monkeypatch):
+    from asgiref.sync import async_to_sync
+    from django_remote_submission.broadcast import broadcaster
+    from django_remote_submission.consumers import JobLogConsumer
+    from django_remote_submission.models import Log
+
+    monkeypatch.setattr(JobLogConsumer, 'log_page_content', 5)
+
+    Log.objects.bulk_ingest([
+        Log(content=content, job=job)
+        for content in ('aa', 'bb', 'c', 'dddddddd', 'e')
+    ])
+    broadcaster.flush()
+
+    async def replay():
+        viewer = log_communicator(job)
+        await viewer.connect()
+        frames = [await viewer.receive_json_from() for i in range(3)]
+        assert await viewer.receive_nothing()
+
+        await viewer.disconnect()
+        return frames
+
+    frames = async_to_sync(replay)()
+
+    assert [[m['content'] for m in frame] for frame in frames] == [
+        ['aa', 'bb', 'c'], ['dddddddd'], ['e']]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_job_log_consumer_resume(job, log_communicator):
+    from asgiref.sync import async_to_sync
+    from django_remote_submission.broadcast import broadcaster
+    from django_remote_submission.models import Log
+
+    Log.objects.bulk_ingest([
+        Log(content='{}'.format(i), job=job) for i in range(5)
+    ])
+    broadcaster.flush()
+
+    async def resume():
+        viewer = log_communicator(job, 'seq=3')
+        await viewer.connect()
+        replayed = await viewer.receive_json_from()
+
+        # The last logs were broadcast again while being replayed
+        await viewer.send_input({
+            'type': 'send_message',
+            'text': [{'seq': 4}, {'seq': None}, {'seq': 5}, {'seq': 6}],
+        })
+        live = await viewer.receive_json_from()
+        assert await viewer.receive_nothing()
+
+        await viewer.disconnect()
+        return replayed, live
+
+    replayed, live = async_to_sync(resume)()
+
+    assert [m['content'] for m in replayed] == ['3', '4']
+    assert live == [{'seq': None}, {'seq': 6}]
+
+
+@pytest.fixture
+def recent_jobs_cache():
+    from django.core.cache import cache
+
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_job_user_consumer_recent_jobs(job, recent_jobs_cache, settings,
+                                       django_assert_num_queries):
+    from asgiref.sync import async_to_sync
+    from channels.testing import WebsocketCommunicator
+    from django_remote_submission import signals
+    from django_remote_submission.broadcast import broadcaster
+    from django_remote_submission.consumers import JobUserConsumer
+    from django_remote_submission.models import Job
+
+    settings.REMOTE_SUBMISSION_RECENT_JOBS = 2
+
+    for i in (2, 3):
+        Job.objects.create(
+            title='{}-job-title'.format(i),
+            program=job.program,
+            remote_directory=job.remote_directory,
+            remote_filename='{}-job-remote_filename'.format(i),
+            server=job.server,
+            owner=job.owner,
+            interpreter=job.interpreter,
+        )
+    broadcaster.flush()
+
+    def user_communicator():
+        communicator = WebsocketCommunicator(
+            JobUserConsumer.as_asgi(), '/ws/job-user/')
+        communicator.scope['user'] = job.owner
+        return communicator
+
+    async def connect():
+        viewer = user_communicator()
+        await viewer.connect()
+        recent = await viewer.receive_json_from()
+
+        other = user_communicator()
+        await other.connect()
+        other_recent = await other.receive_json_from()
+        assert await viewer.receive_nothing()
+
+        await viewer.disconnect()
+        await other.disconnect()
+        return recent, other_recent
+
+    recent, other_recent = async_to_sync(connect)()
+    assert [m['title'] for m in recent] == ['3-job-title', '2-job-title']
+    assert other_recent == recent
+
+    with django_assert_num_queries(0):
+        assert signals.recent_jobs(job.owner_id) == recent
+
+    job.status = Job.STATUS.success
+    job.save()
+
+    # The snapshot was edited in place
+    with django_assert_num_queries(0):
+        recent = signals.recent_jobs(job.owner_id)
+
+    assert [(m['title'], m['status']) for m in recent] == [
+        ('1-job-title', 'success'), ('3-job-title', 'initial')]
+
+    # Another process is editing the snapshot: it is dropped instead
+    key = signals.recent_jobs_key(job.owner_id)
+    recent_jobs_cache.add('{}:lock'.format(key), True)
+    job.status = Job.STATUS.failure
+    job.save()
+    assert recent_jobs_cache.get(key) is None
+    recent_jobs_cache.delete('{}:lock'.format(key))
+
+    with django_assert_num_queries(1):
+        recent = signals.recent_jobs(job.owner_id)
+
+    assert [(m['title'], m['status']) for m in recent] == [
+        ('1-job-title', 'failure'), ('3-job-title', 'initial')]
+
+    # It was dropped while this process was editing it, so the edited
+    # snapshot is dropped too
+    recent_jobs_cache.set('{}:stale'.format(key), True)
+    signals.update_recent_jobs(job.owner_id, recent[1])
+    assert recent_jobs_cache.get(key) is None
@@ -95,3 +95,229 @@ def test_log_string_representation(log):
 def test_result_string_representation(result):
     assert str(result.remote_filename) in str(result)
     assert str(result.job) in str(result)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_log_bulk_ingest(job):
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from django_remote_submission.broadcast import broadcaster
+    from django_remote_submission.models import Log
+
+    broadcaster.flush()
+
+    channel_layer = get_channel_layer()
+    channel_name = async_to_sync(channel_layer.new_channel)()
+    async_to_sync(channel_layer.group_add)(
+        'job-log-{}'.format(job.pk), channel_name)
+
+    logs = Log.objects.bulk_ingest([
+        Log(content='{}-log-content'.format(i), job=job,
+            stream='stdout' if i % 2 == 0 else 'stderr')
+        for i in range(5)
+    ])
+
+    assert Log.objects.count() == 5
+    assert [log.pk for log in logs] == list(
+        Log.objects.order_by('pk').values_list('pk', flat=True))
+
+    broadcaster.flush()
+    message = async_to_sync(channel_layer.receive)(channel_name)
+    assert message['type'] == 'send_message'
+    assert [m['log_id'] for m in message['text']] == [log.pk for log in logs]
+    assert [m['content'] for m in message['text']] == [
+        '{}-log-content'.format(i) for i in range(5)]
+
+    async_to_sync(channel_layer.group_discard)(
+        'job-log-{}'.format(job.pk), channel_name)
+
+
+@pytest.mark.django_db
+def test_log_bulk_ingest_nothing():
+    from django_remote_submission.models import Log
+
+    assert Log.objects.bulk_ingest([]) == []
+
+
+@pytest.mark.django_db
+def test_log_compress(job):
+    from django_remote_submission.models import Log
+    from django_remote_submission.serializers import LogSerializer
+
+    content = 'line: é\n' * 10000
+    log = Log(job=job, stream='stderr')
+    size = log.compress(iter([content[:5], content[5:]]))
+    log.save()
+
+    log = Log.objects.get(pk=log.pk)
+    assert log.content == ''
+    assert log.compression == 'gzip'
+    assert log.blob.name.endswith('stderr.log.gz')
+    assert log.blob.size == size < len(content)
+    assert log.text == content
+
+    assert LogSerializer(log).data['content'] == content
+
+
+@pytest.mark.django_db
+def test_log_message_blob(job, log):
+    from django.utils import timezone
+    from django_remote_submission.logfile import JobLogFile
+    from django_remote_submission.models import Log
+    from django_remote_submission.signals import log_message
+
+    assert log_message(log)['content'] == '1-log-content'
+
+    compressed = Log(job=job)
+    compressed.compress(iter(['1-log-content']))
+    compressed.save()
+    assert 'content' not in log_message(compressed)
+
+    log_file = JobLogFile(job, 'stdout')
+    offset = log_file.size
+    in_file = log_file.log(timezone.now(), iter(['1-log-content']))
+    in_file.save()
+    message = log_message(in_file)
+    assert 'content' not in message
+    assert (message['offset'], message['length']) == (offset, 13)
+
+
+@pytest.mark.django_db
+def test_log_seq(job, server, user, interpreter):
+    from django_remote_submission.models import Job, Log
+
+    other = Job.objects.create(
+        title='2-job-title',
+        program='2-job-program',
+        remote_directory='2-job-remote_directory',
+        remote_filename='2-job-remote_filename',
+        server=server,
+        owner=user,
+        interpreter=interpreter,
+    )
+
+    Log.objects.create(content='a', job=job)
+    Log.objects.bulk_ingest([
+        Log(content='b', job=job),
+        Log(content='c', job=other),
+        Log(content='d', job=job, stream='stderr'),
+    ])
+    Log.objects.create(content='e', job=other)
+    Log(content='f', job=job).save()
+
+    assert list(Log.objects.order_by('pk').values_list(
+        'content', 'seq')) == [
+        ('a', 1), ('b', 2), ('c', 1), ('d', 3), ('e', 2), ('f', 4)]
+
+
+@pytest.mark.django_db
+def test_log_seq_migration(job, server, user, interpreter):
+    from django.apps import apps
+    from django.db import connection
+    from django_remote_submission.models import Job, Log
+    import importlib
+
+    migration = importlib.import_module(
+        'django_remote_submission.migrations.0007_log_seq')
+
+    other = Job.objects.create(
+        title='2-job-title',
+        program='2-job-program',
+        remote_directory='2-job-remote_directory',
+        remote_filename='2-job-remote_filename',
+        server=server,
+        owner=user,
+        interpreter=interpreter,
+    )
+
+    Log.objects.bulk_create([
+        Log(content=str(i), job=job if i % 3 else other) for i in range(7)
+    ])
+    assert not Log.objects.filter(seq__isnull=False).exists()
+
+    schema_editor = type('SchemaEditor', (), {'connection': connection})
+    BATCH_SIZE = migration.BATCH_SIZE
+    migration.BATCH_SIZE = 2
+    try:
+        migration.number_logs(apps, schema_editor)
+    finally:
+        migration.BATCH_SIZE = BATCH_SIZE
+
+    assert list(Log.objects.order_by('pk').values_list(
+        'content', 'seq')) == [
+        ('0', 1), ('1', 1), ('2', 2), ('3', 2), ('4', 3), ('5', 4), ('6', 3)]
+
+
+@pytest.mark.django_db
+def test_log_save_signal_queries(job):
+    from django.db import connection
+    from django.db.models.signals import post_save
+    from django.test.utils import CaptureQueriesContext
+    from django_remote_submission.models import Log
+    from django_remote_submission.signals import update_job_log_listeners
+
+    def count_save_queries():
+        with CaptureQueriesContext(connection) as queries:
+            Log(content='1-log-content', job_id=job.pk).save()
+        return len(queries)
+
+    with_signal = count_save_queries()
+    post_save.disconnect(sender=Log, dispatch_uid='update_job_log_listeners')
+    try:
+        without_signal = count_save_queries()
+    finally:
+        post_save.connect(update_job_log_listeners, sender=Log,
+                          dispatch_uid='update_job_log_listeners')
+
+    assert with_signal == without_signal
+
+
+@pytest.mark.django_db
+def test_job_status_signal_queries(job, user, django_assert_num_queries):
+    from django_remote_submission.models import Job
+    from django_remote_submission.signals import (
+        update_job_status_listeners,
+    )
+
+    def send_status():
+        update_job_status_listeners(
+            sender=Job, instance=Job.objects.get(pk=job.pk), created=False)
+
+    send_status()
+    with django_assert_num_queries(1):
+        send_status()
+
+    user.save()
+    with django_assert_num_queries(2):
+        send_status()
+    with django_assert_num_queries(1):
+        send_status()
+
+
+@pytest.mark.django_db
+def test_log_seq_unique(job, mocker):
+    from django.db import IntegrityError, transaction
+    from django_remote_submission.models import Log, LogManager
+
+    Log.objects.create(content='a', job=job)
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Log.objects.create(content='b', job=job, seq=1)
+
+    # Another writer numbered its log the same way in the meantime
+    number = LogManager._number
+    attempts = []
+
+    def racy_number(self, logs):
+        number(self, logs)
+        attempts.append(logs)
+        if len(attempts) == 1:
+            logs[0].seq = 1
+
+    mocker.patch.object(LogManager, '_number', racy_number)
+
+    log = Log.objects.create(content='c', job=job)
+    assert len(attempts) == 2
+    assert log.seq == 2
+    assert list(Log.objects.order_by('seq').values_list(
+        'content', flat=True)) == ['a', 'c']
@@ -8,7 +8,6 @@ test_django-remote-submission
 Tests for `django-remote-submission` tasks module.
 """
 
-import collections
 import pytest
 import textwrap
 import os
@@ -24,43 +23,6 @@ def pairwise(iterable):
     return zip(a, b)
 
 
-EnvBase = collections.namedtuple('Env', [
-    'server_hostname', 'server_port', 'remote_directory', 'remote_filename',
-    'remote_user', 'remote_password', 'python_path', 'python_arguments',
-])
-
-
-class Env(EnvBase):
-    def __repr__(self):
-        return super(Env, self).__repr__().replace(
-            'remote_password={!r}'.format(self.remote_password),
-            'remote_password={!r}'.format('******'),
-        )
-
-
-@pytest.fixture
-def env():
-    import environ
-
-    path = environ.Path(__file__) - 2
-    env = environ.Env()
-    environ.Env.read_env(path('.env'))
-
-    try:
-        return Env(
-            server_hostname=env('TEST_SERVER_HOSTNAME'),
-            server_port=env.int('TEST_SERVER_PORT'),
-            remote_directory=env('TEST_REMOTE_DIRECTORY'),
-            remote_filename=env('TEST_REMOTE_FILENAME'),
-            remote_user=env('TEST_REMOTE_USER'),
-            remote_password=env('TEST_REMOTE_PASSWORD'),
-            python_path=env('TEST_PYTHON_PATH'),
-            python_arguments=env.list('TEST_PYTHON_ARGUMENTS'),
-        )
-    except Exception as e:
-        pytest.skip('Environment variables not set: {!r}'.format(e))
-
-
 @pytest.fixture
 def user(env):
     from django.contrib.auth import get_user_model
@@ -231,11 +193,6 @@ def test_copy_job(env, job, job_model_saved, runs_remotely):
     assert "successfully copied" in log.content
 
 
-@pytest.mark.skipif(
-    pytest.config.getoption('--ci'),
-    reason='Does not work on continuous integration.',
-)
-@pytest.mark.parametrize("runs_remotely", ["Remote"])
 @pytest.mark.django_db
 @pytest.mark.job_program('''\
 from __future__ import print_function
@@ -246,7 +203,6 @@ for i in range(5):
     time.sleep(0.1)
 ''')
 def test_submit_job_multiple_streams(env, job, runs_remotely):
-    ''' This one cannot run in local as the Live Log is not real '''
     from django_remote_submission.models import Job, Log
     from django_remote_submission.tasks import submit_job_to_server
     import datetime
@@ -284,6 +240,23 @@ def test_submit_job_failure(env, job, runs_remotely):
     assert job.status == Job.STATUS.failure
 
 
+@pytest.mark.django_db
+@pytest.mark.job_program('')
+def test_submit_job_flushes_broadcaster(env, job, runs_remotely, mocker):
+    from django_remote_submission.broadcast import broadcaster
+    from django_remote_submission.models import Job
+    from django_remote_submission.tasks import submit_job_to_server
+
+    def flush():
+        assert Job.objects.get(pk=job.pk).status == Job.STATUS.success
+
+    mocker.patch.object(broadcaster, 'flush', side_effect=flush)
+
+    submit_job_to_server(job.pk, env.remote_password, remote=runs_remotely)
+
+    assert broadcaster.flush.called
+
+
 @pytest.mark.django_db
 @pytest.mark.job_program('''\
 from __future__ import print_function
@@ -325,6 +298,241 @@ def test_submit_job_log_policy_log_none(env, job, runs_remotely):
     assert Log.objects.count() == 0
 
 
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+from __future__ import print_function
+import time
+for i in range(1000):
+    print('line: {}'.format(i))
+time.sleep(1)
+print('last line')
+''')
+def test_submit_job_log_policy_log_batched(env, job, runs_remotely):
+    from django_remote_submission.models import Job, Log
+    from django_remote_submission.tasks import submit_job_to_server, LogPolicy
+
+    submit_job_to_server(job.pk, env.remote_password, remote=runs_remotely,
+                         log_policy=LogPolicy.LOG_BATCHED,
+                         log_flush_interval=0.2, log_flush_size=4096,
+                         buffer_size=1024)
+
+    logs = list(Log.objects.order_by('pk'))
+    content = ''.join(log.content for log in logs)
+    assert content == ''.join(
+        'line: {}\n'.format(i) for i in range(1000)) + 'last line\n'
+
+    # About 9 kB of output, flushed every 4 kB and before the program
+    # goes quiet.
+    assert len(logs) <= 6
+    if runs_remotely:
+        assert len(logs) >= 3
+        assert logs[-1].content == 'last line\n'
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('')
+def test_log_container_log_batched(job):
+    from django_remote_submission.models import Log
+    from django_remote_submission.tasks import LogContainer, LogPolicy
+    from django.utils import timezone
+    import datetime
+
+    start = timezone.now()
+    logs = LogContainer(job, LogPolicy.LOG_BATCHED, flush_interval=0.5,
+                        flush_size=10)
+    assert logs.tick_interval == 0.5
+
+    logs.write_stdout(start, 'abc\n')
+    logs.write_stderr(start + datetime.timedelta(seconds=0.2), 'def\n')
+    logs.tick(start + datetime.timedelta(seconds=0.4))
+    assert Log.objects.count() == 0
+
+    logs.tick(start + datetime.timedelta(seconds=0.5))
+    assert Log.objects.count() == 2
+
+    logs.write_stdout(start + datetime.timedelta(seconds=1), 'ghijklmnop\n')
+    assert Log.objects.count() == 3
+
+    logs.tick(start + datetime.timedelta(seconds=10))
+    assert Log.objects.count() == 3
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('')
+def test_log_container_max_memory(job):
+    from django_remote_submission.models import Log
+    from django_remote_submission.tasks import LogContainer, LogPolicy
+    from django.utils import timezone
+
+    logs = LogContainer(job, LogPolicy.LOG_TOTAL, max_memory=64)
+
+    lines = ['line: {} \u00e9\n'.format(i) for i in range(100)]
+    for line in lines:
+        logs.write_stdout(timezone.now(), line)
+    logs.write_stderr(timezone.now(), 'error\n')
+
+    assert logs._stdout.spilled
+    assert not logs._stderr.spilled
+    assert Log.objects.count() == 0
+
+    logs.flush()
+
+    stdout = Log.objects.filter(stream='stdout').order_by('pk')
+    assert ''.join(log.content for log in stdout) == ''.join(lines)
+    assert all(len(log.content) <= 64 for log in stdout)
+    assert Log.objects.get(stream='stderr').content == 'error\n'
+    assert len(logs._stdout) == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('')
+def test_log_container_compress_size(job):
+    from django_remote_submission.models import Log
+    from django_remote_submission.tasks import LogContainer, LogPolicy
+    from django.utils import timezone
+
+    logs = LogContainer(job, LogPolicy.LOG_TOTAL, max_memory=64,
+                        compress_size=100)
+
+    lines = ['line: {}\n'.format(i) for i in range(100)]
+    for line in lines:
+        logs.write_stdout(timezone.now(), line)
+    logs.write_stderr(timezone.now(), 'error\n')
+    logs.flush()
+
+    stdout = Log.objects.get(stream='stdout')
+    assert stdout.content == ''
+    assert stdout.compression == 'gzip'
+    assert stdout.text == ''.join(lines)
+
+    stderr = Log.objects.get(stream='stderr')
+    assert stderr.content == 'error\n'
+    assert not stderr.blob
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('')
+def test_log_container_log_file(job):
+    from django_remote_submission.logfile import JobLogFile
+    from django_remote_submission.models import Log
+    from django_remote_submission.tasks import LogContainer, LogPolicy
+    from django.utils import timezone
+
+    logs = LogContainer(job, LogPolicy.LOG_LIVE, log_file=True)
+    logs.write_stdout(timezone.now(), 'line: \u00e9\n')
+    logs.write_stdout(timezone.now(), 'line: 1\n')
+    logs.write_stderr(timezone.now(), 'error\n')
+
+    stdout = list(Log.objects.filter(stream='stdout').order_by('pk'))
+    assert [(log.offset, log.length) for log in stdout] == [(0, 9), (9, 8)]
+    assert [log.content for log in stdout] == ['', '']
+    assert [log.text for log in stdout] == ['line: \u00e9\n', 'line: 1\n']
+    assert Log.objects.get(stream='stderr').text == 'error\n'
+
+    log_file = JobLogFile(job, 'stdout')
+    assert log_file.size == 17
+    assert log_file.read(9, 4) == b'line'
+    assert log_file.tail(2) == b'1\n'
+    assert JobLogFile(job, 'stderr').read() == b'error\n'
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.job_program('''\
+from __future__ import print_function
+import time
+for i in range(10):
+    print('line: {}'.format(i))
+    time.sleep(0.05)
+''')
+def test_submit_job_log_writer(env, job, runs_remotely, mocker):
+    from django_remote_submission.models import Log, LogManager
+    from django_remote_submission.tasks import submit_job_to_server
+    import time
+
+    bulk_ingest = LogManager.bulk_ingest
+    calls = []
+
+    def slow_bulk_ingest(self, logs):
+        calls.append(len(logs))
+        time.sleep(0.2)
+        return bulk_ingest(self, logs)
+
+    mocker.patch.object(LogManager, 'bulk_ingest', slow_bulk_ingest)
+
+    submit_job_to_server(job.pk, env.remote_password, remote=runs_remotely,
+                         log_writer=True)
+
+    # Everything is saved before the task returns, and the output that came
+    # in while the database was busy was saved together.
+    logs = list(Log.objects.order_by('pk'))
+    assert ''.join(log.content for log in logs) == ''.join(
+        'line: {}\n'.format(i) for i in range(10))
+    assert sum(calls) == len(logs)
+    assert len(calls) < len(logs)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.job_program('''\
+print('line')
+''')
+def test_submit_job_log_writer_error(env, job, runs_remotely, mocker):
+    from django_remote_submission.models import LogManager
+    from django_remote_submission.tasks import submit_job_to_server
+
+    mocker.patch.object(LogManager, 'bulk_ingest',
+                        side_effect=RuntimeError('logs'))
+
+    with pytest.raises(RuntimeError):
+        submit_job_to_server(job.pk, env.remote_password,
+                             remote=runs_remotely, log_writer=True)
+
+    # The error of the job itself is not hidden by the writer's
+    mocker.patch('django_remote_submission.tasks._upload_program',
+                 side_effect=ValueError('upload'))
+
+    with pytest.raises(ValueError):
+        submit_job_to_server(job.pk, env.remote_password,
+                             remote=runs_remotely, log_writer=True)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.job_program('')
+def test_log_writer_full_queue(job, mocker):
+    from django_remote_submission.models import Log, LogManager
+    from django_remote_submission.tasks import (LogContainer, LogPolicy,
+                                                LogWriter)
+    from django.utils import timezone
+    import threading
+    import time
+
+    bulk_ingest = LogManager.bulk_ingest
+    gate = threading.Event()
+
+    def blocked_bulk_ingest(self, logs):
+        gate.wait()
+        return bulk_ingest(self, logs)
+
+    mocker.patch.object(LogManager, 'bulk_ingest', blocked_bulk_ingest)
+
+    writer = LogWriter(max_pending=1)
+    logs = LogContainer(job, LogPolicy.LOG_LIVE, writer=writer)
+
+    logs.write_stdout(timezone.now(), 'line: 0\n')
+    while not writer._queue.empty():  # taken by the blocked thread
+        time.sleep(0.01)
+
+    logs.write_stdout(timezone.now(), 'line: 1\n')  # fills the queue
+    logs.write_stdout(timezone.now(), 'line: 2\n')  # kept for later
+    assert Log.objects.count() == 0
+
+    gate.set()
+    logs.close()
+    writer.close()
+
+    assert [log.content for log in Log.objects.order_by('pk')] == [
+        'line: 0\n', 'line: 1\n', 'line: 2\n']
+
+
 @pytest.mark.django_db
 @pytest.mark.job_program('''\
 from __future__ import print_function
@@ -349,6 +557,54 @@ def test_submit_job_timeout(env, job, runs_remotely):
     assert job.status == Job.STATUS.failure
 
 
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+print("hello world")
+''')
+def test_submit_job_latency(env, job, runs_remotely, mocker):
+    from django_remote_submission.models import Job
+    from django_remote_submission.tasks import (
+        submit_job_to_server, copy_job_to_server
+    )
+    import time
+
+    # Waiting for the job's output must not poll with a fixed delay
+    sleep = mocker.spy(time, 'sleep')
+
+    submit_job_to_server(job.pk, env.remote_password, remote=runs_remotely)
+    copy_job_to_server(job.pk, env.remote_password, remote=runs_remotely)
+
+    assert sleep.call_count == 0
+
+    job = Job.objects.get(pk=job.pk)
+    assert job.status == Job.STATUS.success
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+import time
+time.sleep(3)
+''')
+def test_submit_job_quiet_job_cpu_usage(env, job, runs_remotely):
+    ''' A long job without output must not keep the worker busy '''
+    from django_remote_submission.models import Job
+    from django_remote_submission.tasks import submit_job_to_server
+    import time
+
+    wall_start = time.time()
+    cpu_start = time.process_time()
+
+    submit_job_to_server(job.pk, env.remote_password, remote=runs_remotely)
+
+    wall = time.time() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    job = Job.objects.get(pk=job.pk)
+    assert job.status == Job.STATUS.success
+    assert cpu < 0.25 * wall, \
+        'wall {:.2f}s, worker cpu {:.2f}s'.format(wall, cpu)
+
+
 @pytest.mark.django_db
 @pytest.mark.job_program('''\
 from __future__ import print_function
@@ -447,6 +703,367 @@ def test_submit_job_modified_files_negative_pattern(env, job, runs_remotely):
             'line: {}\n'.format(i)
 
 
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+for i in range(300):
+    with open('{:03d}.dat'.format(i), 'w') as f:
+        f.write('result {}\\n'.format(i) * 100)
+''')
+@pytest.mark.parametrize('download_workers', [1, 8])
+def test_submit_job_download_rate(env, job, runs_remotely, download_workers,
+                                  mocker):
+    from django_remote_submission.models import Result
+    from django_remote_submission.tasks import submit_job_to_server
+    from django_remote_submission.wrapper.local import LocalWrapper
+    from django_remote_submission.wrapper.remote import RemoteWrapper
+    import threading
+
+    wrapper_cls = RemoteWrapper if runs_remotely else LocalWrapper
+    file_reader = mocker.spy(wrapper_cls, '_file_reader')
+    read_files = wrapper_cls.read_files
+
+    # The rate grows with the number of files transferred at the same time,
+    # which is counted here instead of timing the transfer: the first file
+    # of each worker is held until all the workers are reading one.
+    lock = threading.Lock()
+    counts = {'started': 0, 'reading': 0, 'most_reading': 0}
+    all_reading = threading.Barrier(download_workers, timeout=10)
+
+    def counting_read_files(self, file_attrs, handler, workers=4):
+        def counting_handler(attr, f):
+            with lock:
+                counts['started'] += 1
+                counts['reading'] += 1
+                counts['most_reading'] = max(counts['most_reading'],
+                                             counts['reading'])
+                first = counts['started'] <= download_workers
+            try:
+                if first:
+                    all_reading.wait()
+                return handler(attr, f)
+            finally:
+                with lock:
+                    counts['reading'] -= 1
+
+        return read_files(self, file_attrs, counting_handler, workers)
+
+    mocker.patch.object(wrapper_cls, 'read_files', counting_read_files)
+
+    results = submit_job_to_server(job.pk, env.remote_password,
+                                   remote=runs_remotely,
+                                   store_results=['*.dat'],
+                                   download_workers=download_workers)
+
+    assert counts['most_reading'] == download_workers
+    assert file_reader.call_count == download_workers
+    assert len(results) == 300
+    for i in [0, 150, 299]:
+        result = Result.objects.get(pk=results['{:03d}.dat'.format(i)])
+        assert result.local_file.read().decode('utf-8') == \
+            'result {}\n'.format(i) * 100
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+with open('small.bin', 'w') as f:
+    f.write('a' * 100)
+with open('large.bin', 'w') as f:
+    f.write('b' * 100000)
+''')
+def test_submit_job_max_file_size(env, job, runs_remotely):
+    from django_remote_submission.models import Result
+    from django_remote_submission.tasks import submit_job_to_server
+
+    results = submit_job_to_server(job.pk, env.remote_password,
+                                   remote=runs_remotely,
+                                   store_results=['*.bin'],
+                                   chunk_size=16, max_file_size=1000)
+
+    assert list(results.keys()) == ['small.bin']
+
+    result = Result.objects.get(pk=results['small.bin'])
+    assert result.size == 100
+    assert result.local_file.read().decode('utf-8') == 'a' * 100
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+for i in range(10):
+    with open('{}.out'.format(i), 'w') as f:
+        f.write('x' * 1000)
+''')
+def test_submit_job_max_total_size(env, job, runs_remotely):
+    from django_remote_submission.models import Result
+    from django_remote_submission.tasks import submit_job_to_server
+
+    results = submit_job_to_server(job.pk, env.remote_password,
+                                   remote=runs_remotely,
+                                   store_results=['*.out'],
+                                   max_total_size=3500)
+
+    assert len(results) == 3
+    assert sum(r.size for r in Result.objects.filter(job=job)) == 3000
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+import uuid
+with open('same.chk', 'w') as f:
+    f.write('unchanged\\n')
+with open('changed.chk', 'w') as f:
+    f.write('{}\\n'.format(uuid.uuid4()))
+''')
+def test_submit_job_skip_unchanged(env, job, runs_remotely, mocker):
+    from django_remote_submission.models import Result
+    from django_remote_submission.tasks import submit_job_to_server
+    from django_remote_submission.wrapper.local import LocalWrapper
+    from django_remote_submission.wrapper.remote import RemoteWrapper
+    import hashlib
+
+    first = submit_job_to_server(job.pk, env.remote_password,
+                                 remote=runs_remotely,
+                                 store_results=['*.chk'],
+                                 skip_unchanged=True)
+
+    wrapper_cls = RemoteWrapper if runs_remotely else LocalWrapper
+    read_files = mocker.spy(wrapper_cls, 'read_files')
+    second = submit_job_to_server(job.pk, env.remote_password,
+                                  remote=runs_remotely,
+                                  store_results=['*.chk'],
+                                  skip_unchanged=True)
+
+    transferred = [attr.filename for attr in read_files.call_args[0][1]]
+    assert transferred == ['changed.chk']
+
+    same1 = Result.objects.get(pk=first['same.chk'])
+    same2 = Result.objects.get(pk=second['same.chk'])
+    assert same1.pk != same2.pk
+    assert same1.local_file.name == same2.local_file.name
+    assert same2.checksum == hashlib.sha256(b'unchanged\n').hexdigest()
+    assert same2.size == len(b'unchanged\n')
+
+    # The shared file outlives the result it was first stored for
+    same1.delete()
+    assert same2.local_file.read() == b'unchanged\n'
+
+    changed1 = Result.objects.get(pk=first['changed.chk'])
+    changed2 = Result.objects.get(pk=second['changed.chk'])
+    assert changed1.local_file.name != changed2.local_file.name
+    assert changed1.checksum != changed2.checksum
+    assert changed2.checksum == hashlib.sha256(
+        changed2.local_file.read()).hexdigest()
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('')
+def test_find_unchanged_same_directory(job, mocker):
+    from django_remote_submission.harvest import ResultHarvester
+    from django_remote_submission.models import Job, Result
+
+    other = Job.objects.get(pk=job.pk)
+    other.pk = None
+    other.remote_directory = job.remote_directory + '-other'
+    other.save()
+
+    for earlier in (job, other):
+        Result.objects.create(remote_filename='same.chk', job=earlier,
+                              local_file='same.chk', checksum='0123')
+
+    wrapper = mocker.Mock()
+    wrapper.checksums.return_value = {'same.chk': '0123'}
+    attrs = [mocker.Mock(filename='same.chk')]
+
+    unchanged = ResultHarvester(wrapper, job)._find_unchanged(attrs)
+    assert unchanged['same.chk'].job_id == job.pk
+
+    Result.objects.filter(job=job).delete()
+    assert ResultHarvester(wrapper, job)._find_unchanged(attrs) == {}
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+import os
+for path in ['tree/a/1.txt', 'tree/b/c/2.txt']:
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(path)
+''')
+def test_submit_job_recursive(env, job, runs_remotely):
+    from django_remote_submission.models import Result
+    from django_remote_submission.tasks import submit_job_to_server
+
+    results = submit_job_to_server(job.pk, env.remote_password,
+                                   remote=runs_remotely,
+                                   store_results=['tree/*'])
+    assert results == {}
+
+    results = submit_job_to_server(job.pk, env.remote_password,
+                                   remote=runs_remotely,
+                                   store_results=['tree/*'],
+                                   recursive=True)
+    assert sorted(results) == ['tree/a/1.txt', 'tree/b/c/2.txt']
+
+    for filename, result_pk in results.items():
+        result = Result.objects.get(pk=result_pk)
+        assert result.local_file.name == 'results/{}/{}'.format(
+            job.uuid, filename)
+        assert result.local_file.read().decode('utf-8') == filename
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+import os
+for name in ['keep_1.flt', 'keep_2.flt', 'drop.flt', 'keep_old.flt']:
+    with open(name, 'w') as f:
+        f.write(name)
+os.utime('keep_old.flt', (0, 0))
+''')
+def test_submit_job_filter_remotely(env, job, runs_remotely, mocker):
+    from django_remote_submission.tasks import submit_job_to_server
+    from django_remote_submission.wrapper.remote import RemoteWrapper
+
+    listdir_attr = mocker.spy(RemoteWrapper, 'listdir_attr')
+
+    results = submit_job_to_server(job.pk, env.remote_password,
+                                   remote=runs_remotely,
+                                   store_results=['keep_*.flt',
+                                                  '!keep_2.flt'],
+                                   filter_remotely=True)
+
+    assert list(results) == ['keep_1.flt']
+    if runs_remotely:
+        assert listdir_attr.call_count == 0
+
+
+@pytest.mark.django_db
+def test_submit_jobs_to_server(env, server, user, interpreter, runs_remotely,
+                               mocker):
+    from django_remote_submission.models import Job, Log
+    from django_remote_submission.tasks import submit_jobs_to_server
+    from django_remote_submission.wrapper.local import LocalWrapper
+    from django_remote_submission.wrapper.remote import RemoteWrapper
+
+    jobs = [
+        Job.objects.create(
+            title='job-{}'.format(i),
+            program=textwrap.dedent('''\
+            from __future__ import print_function
+            import sys
+            import time
+            for j in range(3):
+                print('job {} line: {{}}'.format(j))
+                time.sleep(0.1)
+            sys.exit({})
+            '''.format(i, 1 if i == 2 else 0)),
+            remote_directory=env.remote_directory,
+            remote_filename='job_{}_{}'.format(i, env.remote_filename),
+            server=server,
+            owner=user,
+            interpreter=interpreter,
+        )
+        for i in range(4)
+    ]
+
+    wrapper_cls = RemoteWrapper if runs_remotely else LocalWrapper
+    listdir_attr = mocker.spy(wrapper_cls, 'listdir_attr')
+
+    results = submit_jobs_to_server([job.pk for job in jobs],
+                                    env.remote_password,
+                                    remote=runs_remotely,
+                                    store_results=[], max_parallel=2)
+
+    assert sorted(results.keys()) == sorted(job.pk for job in jobs)
+    assert listdir_attr.call_count == 1
+
+    for i, job in enumerate(jobs):
+        job = Job.objects.get(pk=job.pk)
+        if i == 2:
+            assert job.status == Job.STATUS.failure
+        else:
+            assert job.status == Job.STATUS.success
+
+        logs = Log.objects.filter(job=job).order_by('time')
+        assert ''.join(log.content for log in logs) == \
+            ''.join('job {} line: {}\n'.format(i, j) for j in range(3))
+
+
+@pytest.mark.django_db
+def test_submit_jobs_to_server_different_servers(env, job_gen, interpreter,
+                                                 mocker):
+    from django_remote_submission.models import Job, Log, Server
+    from django_remote_submission.tasks import submit_jobs_to_server
+    from django_remote_submission.wrapper.local import LocalWrapper
+
+    job1 = job_gen('print(1)', interpreter)
+    job2 = job_gen('print(2)', interpreter)
+    job2.server = Server.objects.create(
+        title='2-server-title',
+        hostname=env.server_hostname,
+    )
+    job2.save()
+    job3 = job_gen('print(3)', interpreter)
+    job3.remote_filename = 'other_' + job3.remote_filename
+    job3.save()
+
+    connect = mocker.spy(LocalWrapper, 'connect')
+
+    results = submit_jobs_to_server([job1.pk, job2.pk, job3.pk],
+                                    env.remote_password, remote=False)
+
+    assert sorted(results) == [job1.pk, job2.pk, job3.pk]
+    assert connect.call_count == 2
+    for i, job in enumerate([job1, job2, job3]):
+        assert Job.objects.get(pk=job.pk).status == Job.STATUS.success
+        assert Log.objects.get(job=job).content == '{}\n'.format(i + 1)
+
+
+@pytest.mark.django_db
+def test_submit_jobs_to_server_group_error(env, job_gen, interpreter, mocker):
+    from paramiko import AuthenticationException
+    from django_remote_submission.models import Job, Server
+    from django_remote_submission.tasks import submit_jobs_to_server
+    from django_remote_submission.wrapper.local import LocalWrapper
+
+    job1 = job_gen('print(1)', interpreter)
+    job2 = job_gen('print(2)', interpreter)
+    job2.server = Server.objects.create(
+        title='2-server-title',
+        hostname=env.server_hostname,
+    )
+    job2.save()
+
+    connect = LocalWrapper.connect
+    calls = []
+
+    def failing_connect(self, *args, **kwargs):
+        calls.append(self)
+        if len(calls) == 1:
+            raise AuthenticationException('refused')
+        return connect(self, *args, **kwargs)
+
+    mocker.patch.object(LocalWrapper, 'connect', failing_connect)
+
+    results = submit_jobs_to_server([job1.pk, job2.pk], env.remote_password,
+                                    remote=False)
+
+    assert list(results) == [job2.pk]
+    assert Job.objects.get(pk=job1.pk).status == Job.STATUS.failure
+    assert Job.objects.get(pk=job2.pk).status == Job.STATUS.success
+
+
+@pytest.mark.django_db
+def test_submit_jobs_to_server_same_filename(env, job_gen, interpreter):
+    from django_remote_submission.tasks import submit_jobs_to_server
+
+    job1 = job_gen('print(1)', interpreter)
+    job2 = job_gen('print(2)', interpreter)
+
+    with pytest.raises(ValueError):
+        submit_jobs_to_server([job1.pk, job2.pk], env.remote_password,
+                              remote=False)
+
+
 @pytest.mark.django_db
 def test_submit_job_deploy_key(env, job_gen, interpreter_gen, runs_remotely):
     from django_remote_submission.models import Job, Log
@@ -477,7 +1094,7 @@ def test_submit_job_deploy_key(env, job_gen, interpreter_gen, runs_remotely):
     remove_existing_key_job = job_gen(
         program='''\
         sed -i.bak -e /{key}/d ~/.ssh/authorized_keys
-        '''.format(key=cmd_quote(key.replace('/', '\/'))),
+        '''.format(key=cmd_quote(key.replace('/', '\\/'))),
         interpreter=sh,
     )
 
@@ -575,3 +1192,82 @@ def test_deploy_and_delete_key(env):
         with wrapper.connect():
             pass
 
+
+
+@pytest.mark.django_db
+@pytest.mark.job_program('''\
+from __future__ import print_function
+import time
+for i in range(3):
+    print('line: {}'.format(i))
+    time.sleep(0.1)
+with open('async.aio', 'w') as f:
+    print('result', file=f)
+''')
+def test_submit_job_async(env, job, runs_remotely):
+    from django_remote_submission.asynctasks import submit_job_to_server_async
+    from django_remote_submission.models import Job, Log, Result
+    from asgiref.sync import async_to_sync
+
+    if runs_remotely:
+        pytest.importorskip('asyncssh')
+
+    results = async_to_sync(submit_job_to_server_async)(
+        job.pk, env.remote_password, remote=runs_remotely,
+        store_results=['*.aio'],
+    )
+
+    job = Job.objects.get(pk=job.pk)
+    assert job.status == Job.STATUS.success
+
+    assert [log.content for log in Log.objects.order_by('pk')] == [
+        'line: {}\n'.format(i) for i in range(3)]
+
+    assert list(results) == ['async.aio']
+    result = Result.objects.get(pk=results['async.aio'])
+    assert result.local_file.read() == b'result\n'
+    assert result.size == 7
+
+
+@pytest.mark.django_db
+def test_submit_jobs_async_concurrently(env, job_gen, interpreter,
+                                        runs_remotely):
+    from django_remote_submission.asynctasks import submit_job_to_server_async
+    from django_remote_submission.models import Job, Log
+    from asgiref.sync import async_to_sync
+    import asyncio
+
+    if runs_remotely:
+        pytest.importorskip('asyncssh')
+
+    jobs = []
+    for i in range(3):
+        job = job_gen('''\
+            import time
+            print(time.time())
+            time.sleep(0.5)
+            print(time.time())
+        ''', interpreter)
+        job.remote_filename = 'concurrent_{}.py'.format(i)
+        job.save()
+        jobs.append(job)
+
+    async def submit_all():
+        return await asyncio.gather(*[
+            submit_job_to_server_async(job.pk, env.remote_password,
+                                       remote=runs_remotely)
+            for job in jobs
+        ])
+
+    async_to_sync(submit_all)()
+
+    # The jobs were all running at the same time
+    starts, ends = [], []
+    for job in jobs:
+        assert Job.objects.get(pk=job.pk).status == Job.STATUS.success
+        logs = Log.objects.filter(job=job).order_by('seq')
+        start, end = ''.join(log.content for log in logs).split()
+        starts.append(float(start))
+        ends.append(float(end))
+
+    assert max(starts) < min(ends)
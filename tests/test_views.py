@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-remote-submission
+------------
+
+Tests for `django-remote-submission` views module.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def job():
+    from django_remote_submission.models import Interpreter, Job, Server
+    from django.contrib.auth import get_user_model
+
+    return Job.objects.create(
+        title='1-job-title',
+        program='1-job-program',
+        remote_directory='1-job-remote_directory',
+        remote_filename='1-job-remote_filename',
+        server=Server.objects.create(
+            title='1-server-title',
+            hostname='1-server-hostname.invalid',
+        ),
+        owner=get_user_model().objects.create(username='1-user-username'),
+        interpreter=Interpreter.objects.create(
+            name='1-interpreter-name',
+            path='1-interpreter-path',
+        ),
+    )
+
+
+@pytest.fixture
+def get_log():
+    from django_remote_submission.views import JobViewSet
+    from rest_framework.test import APIRequestFactory
+
+    view = JobViewSet.as_view({'get': 'log'})
+    factory = APIRequestFactory()
+
+    def get(job, **params):
+        return view(factory.get('/jobs/{}/log/'.format(job.pk), params),
+                    pk=job.pk)
+
+    return get
+
+
+@pytest.mark.django_db
+def test_job_log(job, get_log):
+    from django_remote_submission.logfile import JobLogFile
+
+    JobLogFile(job, 'stdout').append(['0123456789'])
+    JobLogFile(job, 'stdout').append(['abcdef'])
+
+    response = get_log(job)
+    assert response.status_code == 200
+    assert response.data == {
+        'stream': 'stdout', 'offset': 0, 'length': 16, 'next_offset': 16,
+        'size': 16, 'content': '0123456789abcdef',
+    }
+
+    response = get_log(job, offset=8, length=4)
+    assert response.data['content'] == '89ab'
+
+    response = get_log(job, tail=3)
+    assert response.data['offset'] == 13
+    assert response.data['content'] == 'def'
+
+    response = get_log(job, stream='stderr')
+    assert response.data['size'] == 0
+    assert response.data['content'] == ''
+
+
+@pytest.mark.django_db
+def test_job_log_bounded(job, get_log, monkeypatch):
+    from django_remote_submission.logfile import JobLogFile
+    from django_remote_submission.views import JobViewSet
+
+    monkeypatch.setattr(JobViewSet, 'log_length', 4)
+    monkeypatch.setattr(JobViewSet, 'log_max_length', 6)
+
+    JobLogFile(job, 'stdout').append(['0123456789abcdef'])
+
+    response = get_log(job)
+    assert response.data['content'] == '0123'
+    assert response.data['next_offset'] == 4
+
+    response = get_log(job, offset=4, length=100)
+    assert response.data['content'] == '456789'
+    assert response.data['next_offset'] == 10
+
+    response = get_log(job, tail=100)
+    assert response.data['offset'] == 10
+    assert response.data['content'] == 'abcdef'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('params', [
+    {'stream': 'stdin'}, {'tail': '-1'}, {'offset': 'abc'},
+])
+def test_job_log_invalid(job, get_log, params):
+    response = get_log(job, **params)
+    assert response.status_code == 400
+    assert list(response.data) == list(params)
+
+
+@pytest.mark.django_db
+def test_log_list_since(job):
+    from django_remote_submission.models import Log
+    from django_remote_submission.views import LogViewSet
+    from rest_framework.test import APIRequestFactory
+
+    Log.objects.bulk_ingest([
+        Log(content='{}-log-content'.format(i), job=job) for i in range(5)
+    ])
+
+    view = LogViewSet.as_view({'get': 'list'})
+    response = view(APIRequestFactory().get('/logs/', {
+        'job': job.pk, 'since': 3,
+    }))
+
+    assert response.status_code == 200
+    assert [log['seq'] for log in response.data['results']] == [4, 5]
+    assert [log['content'] for log in response.data['results']] == [
+        '3-log-content', '4-log-content']
+
+
+@pytest.mark.django_db
+def test_log_list_log_files(job, mocker):
+    from django.utils import timezone
+    from django_remote_submission.logfile import JobLogFile
+    from django_remote_submission.models import Log
+    from django_remote_submission.views import LogViewSet
+    from rest_framework.test import APIRequestFactory
+
+    logs = []
+    for i in range(6):
+        stream = 'stdout' if i % 2 == 0 else 'stderr'
+        logs.append(JobLogFile(job, stream).log(
+            timezone.now(), ['{}-log-content\n'.format(i)]))
+    compressed = Log(job=job)
+    compressed.compress(['6-log-content\n'])
+    logs.append(compressed)
+    logs.append(Log(job=job, content='7-log-content\n'))
+    Log.objects.bulk_ingest(logs)
+
+    storage = Log._meta.get_field('blob').storage
+    opened = mocker.spy(storage, 'open')
+
+    view = LogViewSet.as_view({'get': 'list'})
+    response = view(APIRequestFactory().get('/logs/', {
+        'job': job.pk, 'since': 0,
+    }))
+
+    assert response.status_code == 200
+    assert [log['content'] for log in response.data['results']] == [
+        '{}-log-content\n'.format(i) for i in range(8)]
+
+    # Once for each log file, and once for the compressed log
+    assert opened.call_count == 3
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-remote-submission
+------------
+
+Tests for `django-remote-submission` wrapper module.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def output():
+    return []
+
+
+@pytest.fixture
+def handler(output):
+    def handler(now, text):
+        output.append(text)
+
+    return handler
+
+
+def test_stream_reader_multibyte_character_split(handler, output):
+    from django_remote_submission.wrapper.stream import StreamReader
+
+    reader = StreamReader(handler)
+
+    data = 'déjà vu\n'.encode('utf-8')
+    for i in range(len(data)):
+        reader.feed(None, data[i:i + 1])
+    reader.close(None)
+
+    assert ''.join(output) == 'déjà vu\n'
+
+
+def test_stream_reader_invalid_bytes_are_replaced(handler, output):
+    from django_remote_submission.wrapper.stream import StreamReader
+
+    reader = StreamReader(handler)
+    reader.feed(None, b'abc\xff\n')
+    reader.close(None)
+
+    assert output == ['abc�\n']
+
+
+def test_stream_reader_line_buffered(handler, output):
+    from django_remote_submission.wrapper.stream import StreamReader
+
+    reader = StreamReader(handler, line_buffered=True)
+    reader.feed(None, b'line: 0')
+    reader.feed(None, b'\nline: 1\nline')
+    reader.feed(None, b': 2\n')
+    reader.feed(None, b'no newline')
+    reader.close(None)
+
+    assert output == ['line: 0\nline: 1\n', 'line: 2\n', 'no newline']
+
+
+def test_stream_reader_line_buffered_long_line(handler, output):
+    from django_remote_submission.wrapper.stream import StreamReader
+
+    reader = StreamReader(handler, buffer_size=8, line_buffered=True)
+    reader.feed(None, b'0123')
+    reader.feed(None, b'4567')
+    reader.feed(None, b'89\n')
+    reader.close(None)
+
+    assert output == ['01234567', '89\n']
+
+
+def test_stream_reader_without_handler():
+    from django_remote_submission.wrapper.stream import StreamReader
+
+    reader = StreamReader(None, line_buffered=True)
+    reader.feed(None, b'hello\n')
+    reader.close(None)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        pass
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+class FakeSFTP(object):
+    def __init__(self, client):
+        self.channel = client.transport
+        self.channel.closed = False
+
+    def get_channel(self):
+        return self.channel
+
+    def chdir(self, path):
+        pass
+
+    def close(self):
+        self.channel.closed = True
+
+
+@pytest.fixture
+def connect():
+    def connect():
+        client = FakeClient()
+        connect.opened.append(client)
+        return client, FakeSFTP(client)
+
+    connect.opened = []
+    return connect
+
+
+KEY = ('foo.invalid', 22, 'john')
+
+
+def test_pool_reuses_released_connection(connect):
+    from django_remote_submission.wrapper.pool import ConnectionPool
+
+    pool = ConnectionPool()
+
+    first = pool.acquire(KEY, 'secret', connect)
+    pool.release(first)
+    second = pool.acquire(KEY, 'secret', connect)
+
+    assert second is first
+    assert len(connect.opened) == 1
+
+
+def test_pool_does_not_share_credentials(connect):
+    from django_remote_submission.wrapper.pool import ConnectionPool
+
+    pool = ConnectionPool()
+
+    pool.release(pool.acquire(KEY, 'secret', connect))
+    other = pool.acquire(KEY, 'other secret', connect)
+
+    assert other.client is connect.opened[1]
+    assert len(connect.opened) == 2
+
+
+def test_pool_discards_unhealthy_connection(connect):
+    from django_remote_submission.wrapper.pool import ConnectionPool
+
+    pool = ConnectionPool()
+
+    first = pool.acquire(KEY, 'secret', connect)
+    pool.release(first)
+    first.client.transport.active = False
+
+    second = pool.acquire(KEY, 'secret', connect)
+
+    assert second is not first
+    assert first.client.closed
+
+
+def test_pool_evicts_idle_connections(connect):
+    from django_remote_submission.wrapper.pool import ConnectionPool
+
+    pool = ConnectionPool(idle_timeout=0)
+
+    first = pool.acquire(KEY, 'secret', connect)
+    pool.release(first)
+
+    assert first.client.closed
+
+
+def test_pool_max_per_host(connect):
+    from django_remote_submission.wrapper.pool import ConnectionPool
+
+    pool = ConnectionPool(max_per_host=1, wait_timeout=0.1)
+
+    first = pool.acquire(KEY, 'secret', connect)
+    with pytest.raises(RuntimeError):
+        pool.acquire(KEY, 'secret', connect)
+
+    # Other hosts are not affected by the limit
+    pool.acquire(('bar.invalid', 22, 'john'), 'secret', connect)
+
+    pool.release(first)
+    assert pool.acquire(KEY, 'secret', connect) is first
+
+
+def test_pool_not_reusable_connection_is_closed(connect):
+    from django_remote_submission.wrapper.pool import ConnectionPool
+
+    pool = ConnectionPool(max_per_host=1)
+
+    first = pool.acquire(KEY, 'secret', connect)
+    first.reusable = False
+    pool.release(first)
+
+    assert first.client.closed
+    assert pool.acquire(KEY, 'secret', connect) is not first
+
+
+def test_local_wrapper_exec_commands_streams(tmpdir):
+    from django_remote_submission.wrapper.local import LocalWrapper
+    import collections
+    import sys
+    import textwrap
+    import time
+
+    program = textwrap.dedent('''\
+        import sys, time
+        print("first")
+        sys.stdout.flush()
+        time.sleep(0.5)
+        print("last")
+        sys.exit(int(sys.argv[1]))
+    ''')
+    tmpdir.join('job.py').write(program)
+
+    received = collections.defaultdict(list)
+    ticks = []
+
+    def make_handler(name):
+        def handler(now, text):
+            received[name].append((time.time(), text))
+
+        return handler
+
+    wrapper = LocalWrapper(hostname='localhost', username='foo')
+    start = time.time()
+    statuses = wrapper.exec_commands([
+        dict(args=[sys.executable, 'job.py', str(i)], workdir=str(tmpdir),
+             stdout_handler=make_handler(i), tick_handler=ticks.append)
+        for i in range(2)
+    ], line_buffered=True, tick_interval=0.1)
+
+    assert statuses == [True, False]
+    assert time.time() - start < 0.9
+    assert len(ticks) >= 3
+    for i in range(2):
+        (first_time, first), (last_time, last) = received[i]
+        assert (first, last) == ('first\n', 'last\n')
+        assert last_time - first_time >= 0.4
+
+
+@pytest.mark.skipif(
+    pytest.config.getoption('--ci'),
+    reason='Does not work on continuous integration.',
+)
+def test_remote_wrapper_run_in_cwd_stderr(env):
+    from django_remote_submission.wrapper.remote import RemoteWrapper
+
+    wrapper = RemoteWrapper(
+        hostname=env.server_hostname,
+        username=env.remote_user,
+        port=env.server_port,
+    )
+
+    # More than a channel's window on stderr, before writing to stdout
+    command = ('python3 -c "import sys; sys.stderr.write(\'x\' * 4194304); '
+               'print(\'done\')"')
+    with wrapper.connect(env.remote_password):
+        status, output = wrapper._run_in_cwd(command)
+
+    assert status == 0
+    assert output.strip() == b'done'